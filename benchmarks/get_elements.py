@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Benchmark for splitting data lines into elements
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import core # pylint: disable=wrong-import-position
+import core_functions # pylint: disable=wrong-import-position
+
+################################################################################
+# the original approach, kept here for comparison
+################################################################################
+
+def legacy_get_elements(line):
+    delim = '\x00'
+    line = re.sub(core.Main.line_parse_delimiter_, delim, line.lstrip())
+    elements = line.split(delim)
+    for i, element in enumerate(elements):
+        if element == core.Main.line_element_placeholder_:
+            elements[i] = ' '
+    return elements
+
+################################################################################
+# run the benchmark
+################################################################################
+
+def make_data_file(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(rows):
+            payment = f"{i % 500 + 0.45:.2f}" if i % 7 else '-'
+            deposit = '-' if i % 7 else '1500.00'
+            f.write(f"  TACOS EAT  11/{i % 28 + 1:02d}/2023  {payment}  *  {deposit}  description {i % 100}\n")
+
+def measure(label, function, lines):
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>14}: {len(lines) / elapsed:12,.0f} lines/sec ({elapsed:.3f}s)")
+    return elapsed
+
+def main(argv):
+    rows = int(argv[1]) if len(argv) > 1 else 1000000
+    core.reset()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'data')
+        make_data_file(path, rows)
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line.rstrip('\n') for line in f]
+    for line in lines[:1000]:
+        assert legacy_get_elements(line) == core_functions.get_elements(line)
+    print(f"{rows:,} rows")
+    before = measure('before', legacy_get_elements, lines)
+    after = measure('after', core_functions.get_elements, lines)
+    print(f"{'speedup':>14}: {before / after:.2f}x")
+
+if __name__ == '__main__':
+    main(sys.argv)
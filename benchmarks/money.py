@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Benchmark for the banking money modes
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import core # pylint: disable=wrong-import-position
+from plugins import banking # pylint: disable=wrong-import-position
+
+################################################################################
+# the original float parsing, kept here for comparison
+################################################################################
+
+def legacy_parse_amount(amount):
+    amount = re.sub(r'^\d\.-', '', amount)
+    if amount.strip() == '':
+        amount = 0.0
+    try:
+        return float(amount)
+    except ValueError:
+        return None
+
+################################################################################
+# run the benchmark
+################################################################################
+
+def make_amounts(rows, distinct):
+    amounts = []
+    for i in range(rows):
+        amounts.append(f"{i * 7919 % distinct / 100:.2f}" if i % 7 else ' ')
+        amounts.append(' ' if i % 7 else '1500.00')
+    return amounts
+
+def add_amounts(parse, mode, amounts):
+    # parse and add up the amounts as plugin_main and CategoryStats do
+    total = mode.zero
+    for amount in amounts:
+        value = parse(amount, mode)
+        if value is not None:
+            total += value
+    return total
+
+def measure(label, parse, mode, amounts):
+    start = time.perf_counter()
+    total = add_amounts(parse, mode, amounts)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>14}: {len(amounts) / elapsed:12,.0f} amounts/sec ({elapsed:.3f}s, total {mode.value(total):,.2f})")
+    return elapsed
+
+def main(argv):
+    rows = int(argv[1]) if len(argv) > 1 else 1000000
+    core.reset()
+    modes = banking.MONEY_MODES
+    for distinct in [1000, 1000000]:
+        amounts = make_amounts(rows, distinct)
+        print(f"{rows:,} rows, {distinct:,} distinct amounts")
+        before = measure('before', lambda amount, mode: legacy_parse_amount(amount), modes['float'], amounts)
+        float_time = None
+        for name in ['float', 'cents', 'decimal']:
+            after = measure(name, banking.parse_amount, modes[name], amounts)
+            float_time = float_time or after
+            # the exact modes are compared with the float mode they would replace
+            print(f"{'vs before':>14}: {before / after:.2f}x    vs float: {float_time / after:.2f}x")
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -16,9 +16,16 @@
 import importlib
 import traceback
 
+import core_session
+
 def placeholder(place = '', holder = ''):
     return f"{place}{holder}"
 
+def no_results():
+    return {}
+
+# the active plugin belongs to the current session
+@core_session.session_state(extra = ['get_env', 'identify', 'parse_line', 'parse_option', 'reset', 'my', 'get_results', 'settings', 'parse_elements', 'get_checkpoint', 'set_checkpoint'])
 class Plugin():
     get_env = placeholder
     identify = placeholder
@@ -26,6 +33,11 @@ class Plugin():
     parse_option = placeholder
     reset = placeholder
     my = placeholder
+    get_results = no_results
+    settings = None
+    parse_elements = None
+    get_checkpoint = None
+    set_checkpoint = None
 
 def use_plugin(plugin_name):
     try:
@@ -36,6 +48,19 @@ def use_plugin(plugin_name):
         Plugin.parse_option = p.parse_option
         Plugin.reset = p.reset
         Plugin.my = p.My
+
+        # optional: final values for crunchy.render
+        Plugin.get_results = getattr(p, 'get_results', no_results)
+
+        # optional: settings for the &set directive
+        Plugin.settings = getattr(p, 'SETTINGS', None)
+
+        # optional: rows released by &var.release, already split into elements
+        Plugin.parse_elements = getattr(p, 'parse_elements', None)
+
+        # optional: running totals for --checkpoint and --resume-from
+        Plugin.get_checkpoint = getattr(p, 'get_checkpoint', None)
+        Plugin.set_checkpoint = getattr(p, 'set_checkpoint', None)
         Plugin.reset()
     except AttributeError as e:
         raise AttributeError from e
@@ -13,6 +13,8 @@
 # See the LICENSE file in the project root for more information.
 ################################################################################
 
+import functools
+import re
 import shutil
 from pathlib import Path
 from datetime import datetime
@@ -25,20 +27,28 @@ except ImportError:
 import core_directives
 import core_functions
 import core_options
+import core_output
+import core_session
 import testing_functions
 
 ################################################################################
 # all primary environment values and functions are accessed here
+#
+#    - Values ending in '_' belong to the current session (see core_session).
 ################################################################################
 
+@core_session.session_state(shared = ['version_', 'source_path_'])
 class Main():
     formats_ = []
+    formatters_ = []
     headers_ = []
     justify_ = []
     padding_ = []
     line_element_placeholder_ = None
     line_parse_delimiter_ = None
     map_ = []
+    renderer_ = None
+    splitter_ = None
     using_headers_ = None
     width_ = []
 
@@ -66,6 +76,7 @@ class Main():
     float_format_ = '{:,.2f}'
     percentage_format_ = '{:.2f}%'
     datetime_format_ = '%Y-%m-%d'
+    date_format_in_ = None
     header_mode_ = None
     interactive_ = False
     interactive_prompt_ = '> '
@@ -77,18 +88,23 @@ class Main():
     version_ = ''
     does_not_process_data = ['shell']
 
-    # dateutil wrapper to support environments missing this module
+    # dateutil wrapper to support environments missing this module (see parse_date)
     class DateUtil:
         warning_message_sent = False
 
         @classmethod
         def parse(cls, datestr):
-            if DATEUTIL_IMPORTED:
-                return parser.parse(datestr, fuzzy=True)
-            if not cls.warning_message_sent:
-                core_functions.error_message('Could not import dateutil module.  Date functionality will be limited.')
-                cls.warning_message_sent = True
-            return datetime.strptime(datestr, Main.datetime_format_)
+            date = parse_date(datestr, Main.date_format_in_)
+            if date is None:
+                raise ValueError(f"Invalid date: {datestr}")
+            return date
+
+        @classmethod
+        def format(cls, datestr):
+            text = format_date(datestr, Main.date_format_in_, Main.datetime_format_)
+            if text is None:
+                raise ValueError(f"Invalid date: {datestr}")
+            return text
 
     # construct messaging class
     class Messaging:
@@ -96,6 +112,9 @@ class Main():
         error_message = core_functions.error_message
     msg = Messaging
 
+    # buffered output for the current session (see core_output)
+    writer = property(lambda self: core_session.current().writer)
+
     # construct parser class from core_directives, core_functions, and core_options
     parser = core_directives.DirectiveParser
     parser.freeze_history = core_functions.freeze_history
@@ -104,23 +123,30 @@ class Main():
     parser.parse_options = core_options.parse_options
     parser.unrecognized_option = core_options.unrecognized_option
 
+@core_session.session_state(extra = ['debug_print_mode'])
 class Testing():
     testing_ = []
     test_filename_ = []
-    test_f_ = []
+    test_comparator_ = []
     test_pause_ = []
     test_verbose_ = []
     test_pass_ = []
     test_fail_ = []
+    results_ = []
     reset = testing_functions.reset
     testMessage = testing_functions.test_message
     testStop = testing_functions.test_stop
+    testCompare = testing_functions.test_compare
     testVersions = testing_functions.test_versions
     debug = testing_functions.debug
     debug_print = testing_functions.debug_print
     debug_print_mode = None
+    max_reported_diffs = 10
 
+@core_session.session_state()
 class Cli():
+    checkpoint_ = None
+    resume_from_ = None
     ignore_stop_ = None
     ignore_stop_reset_ = None
     verbose_verbose_ = None
@@ -128,14 +154,91 @@ class Cli():
     test_force_quiet_ = None
     test_force_verbose_ = None
 
+################################################################################
+# date parsing
+#
+#    - Dates in a known layout are cached by string, since data files repeat
+#      the same dates many times; invalid dates are cached as None.
+#    - With &set dateformat-in, that format is tried first.
+#    - YYYY-MM-DD and MM/DD/YYYY are parsed without fuzzy matching, giving the
+#      same dates as dateutil; anything else goes to dateutil, uncached, since
+#      fuzzy matching fills in missing parts (e.g., the year) from today.
+#    - Without dateutil, dates are parsed with the datetime format, which is
+#      part of the cache key.
+################################################################################
+
+ISO_DATE_RE = re.compile(r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})')
+US_DATE_RE = re.compile(r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})')
+FUZZY = object() # parse_layout result for dates left to dateutil
+
+def parse_date(datestr, date_format_in):
+    if DATEUTIL_IMPORTED:
+        date = parse_layout(datestr, date_format_in)
+        if date is not FUZZY:
+            return date
+        try:
+            return parser.parse(datestr, fuzzy=True)
+        except ValueError:
+            return None
+    if not Main.DateUtil.warning_message_sent:
+        core_functions.error_message('Could not import dateutil module.  Date functionality will be limited.')
+        Main.DateUtil.warning_message_sent = True
+    return parse_formats(datestr, date_format_in, Main.datetime_format_)
+
+@functools.lru_cache(maxsize=4096)
+def parse_layout(datestr, date_format_in):
+    if date_format_in is not None:
+        try:
+            return datetime.strptime(datestr, date_format_in)
+        except ValueError:
+            pass
+    m = ISO_DATE_RE.fullmatch(datestr)
+    if m is not None:
+        year, month, day = m.groups()
+    else:
+        m = US_DATE_RE.fullmatch(datestr)
+        if m is not None:
+            month, day, year = m.groups()
+    if m is not None:
+        try:
+            return datetime(int(year), int(month), int(day))
+        except ValueError:
+            pass
+    return FUZZY
+
+@functools.lru_cache(maxsize=4096)
+def parse_formats(datestr, date_format_in, datetime_format):
+    for date_format in (date_format_in, datetime_format):
+        if date_format is not None:
+            try:
+                return datetime.strptime(datestr, date_format)
+            except ValueError:
+                pass
+    return None
+
+def format_date(datestr, date_format_in, datetime_format):
+    date = parse_date(datestr, date_format_in)
+    if date is None:
+        return None
+    return format_datetime(date, datetime_format)
+
+@functools.lru_cache(maxsize=4096)
+def format_datetime(date, datetime_format):
+    return date.strftime(datetime_format)
+
+################################################################################
+
 def reset(full_reset = True):
     Main.formats_ = set_list_value(Main.formats_, None)
+    Main.formatters_ = set_list_value(Main.formatters_, None)
     Main.headers_ = set_list_value(Main.headers_, None)
     Main.justify_ = set_list_value(Main.justify_, None)
     Main.padding_ = set_list_value(Main.padding_, None)
     Main.line_element_placeholder_ = '-'
     Main.line_parse_delimiter_ = r'\s\s\s*'
     Main.map_ = set_list_value(Main.map_, None)
+    Main.renderer_ = None
+    Main.splitter_ = None
     Main.using_headers_ = True
     Main.width_ = set_list_value(Main.width_, None)
 
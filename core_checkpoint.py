@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Checkpoints for resuming a run where an earlier one left off
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import hashlib
+import itertools
+import json
+import os
+
+import bridge
+import core
+import core_functions
+import core_output
+import core_session
+import var_functions
+
+################################################################################
+# checkpoints (--checkpoint, --resume-from)
+#
+#    - A checkpoint is a JSON file with the number of input lines read, a
+#      SHA-256 hash of those lines, and the plugin's running totals (from its
+#      get_checkpoint function).  It is written at the end of the input.
+#    - When resuming, the input must start with the same lines; otherwise,
+#      all lines are processed as usual.
+#    - Lines already in the checkpoint are replayed without output, skipping
+#      their data rows, so headers, settings and variables are set up again.
+#      Then the plugin restores its totals with set_checkpoint.
+#    - Rows that set up state (headers, captured rows, rows with references)
+#      are not skipped; the plugin totals are replaced afterwards anyway.
+#    - Files read with &read are not part of the hash.  &cli can take its own
+#      --checkpoint and --resume-from options, for the files it reads.
+################################################################################
+
+VERSION = 2
+
+@core_session.session_state()
+class Checkpoint():
+    lines_ = 0
+    hash_ = None
+    complete_ = False
+
+def supported():
+    return bridge.Plugin.get_checkpoint is not None and bridge.Plugin.set_checkpoint is not None
+
+def line_hash(line):
+    # lines are hashed without the line break, so files and crunchy.render agree
+    return line.rstrip('\n').encode() + b'\n'
+
+########################################
+
+def input_lines(lines):
+    # the input lines, after any checkpoint prefix, counted for a new checkpoint
+    if core.Cli.checkpoint_ is None and core.Cli.resume_from_ is None:
+        return lines
+    if not supported():
+        core.Main.msg.error_message(f"Plugin does not support checkpoints: {bridge.Plugin.identify()}")
+        return lines
+    Checkpoint.lines_ = 0
+    Checkpoint.hash_ = hashlib.sha256()
+    Checkpoint.complete_ = False
+    lines = iter(lines)
+    if core.Cli.resume_from_ is not None:
+        lines = resume(core.Cli.resume_from_, lines)
+    return count_lines(Checkpoint.state(), lines)
+
+def count_lines(state, lines):
+    # the state is bound up front, since crunchy.render reads lines between sessions
+    for line in lines:
+        state.lines_ += 1
+        state.hash_.update(line_hash(line))
+        yield line
+    # not reached when the run stops early (e.g., &stop or an error)
+    state.complete_ = True
+
+########################################
+
+def resume(path, lines):
+    checkpoint = read_checkpoint(path)
+    if checkpoint is None:
+        return lines
+    prefix = list(itertools.islice(lines, checkpoint['lines']))
+    digest = hashlib.sha256()
+    for line in prefix:
+        digest.update(line_hash(line))
+    if len(prefix) < checkpoint['lines'] or digest.hexdigest() != checkpoint['hash']:
+        core.Main.msg.info_message(f"Input does not match checkpoint {path}; processing all lines.")
+        return itertools.chain(prefix, lines)
+    replay(prefix)
+    bridge.Plugin.set_checkpoint(checkpoint['totals'])
+    Checkpoint.lines_ = len(prefix)
+    Checkpoint.hash_ = digest
+    core.Main.msg.info_message(f"Resuming after line {len(prefix)}.")
+    return lines
+
+def read_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        core.Main.msg.info_message(f"Checkpoint not found: {path}; processing all lines.")
+        return None
+    except (OSError, ValueError):
+        core.Main.msg.error_message(f"Invalid checkpoint: {path}")
+        return None
+    if not isinstance(checkpoint, dict) or checkpoint.get('version') != VERSION or \
+            not isinstance(checkpoint.get('lines'), int) or 'hash' not in checkpoint or 'totals' not in checkpoint:
+        core.Main.msg.error_message(f"Invalid checkpoint: {path}")
+        return None
+    if checkpoint.get('plugin') != bridge.Plugin.identify():
+        core.Main.msg.error_message(f"Checkpoint is for another plugin: {path}")
+        return None
+    return checkpoint
+
+def replay(lines):
+    # output (including error messages) was already shown by the earlier run,
+    # and is not compared when testing
+    session = core_session.current()
+    writer = session.writer
+    session.writer = core_output.RowCollector()
+    testing = core.Testing.testing_[-1]
+    core.Testing.testing_[-1] = False
+    try:
+        main = core.Main.state()
+        parser = core.Main.parser()
+        for line in lines:
+            line = line.rstrip('\n')
+            if not core_functions.skip_line(line):
+                if parser.is_directive(line) or '{' in line or main.capture_mode_ or \
+                        main.header_mode_ or main.headers_[-1] is None:
+                    bridge.Plugin.parse_line(var_functions.parse_references(line))
+            var_functions.process_release()
+    finally:
+        session.writer = writer
+        core.Testing.testing_[-1] = testing
+
+def suspend():
+    # set aside the checkpoint of the input, while &cli reads other files
+    saved = (core.Cli.checkpoint_, core.Cli.resume_from_, Checkpoint.lines_, Checkpoint.hash_, Checkpoint.complete_)
+    core.Cli.checkpoint_ = None
+    core.Cli.resume_from_ = None
+    return saved
+
+def restore(saved):
+    core.Cli.checkpoint_, core.Cli.resume_from_, Checkpoint.lines_, Checkpoint.hash_, Checkpoint.complete_ = saved
+
+########################################
+
+def save():
+    path = core.Cli.checkpoint_
+    if path is None or Checkpoint.hash_ is None:
+        return
+    if not Checkpoint.complete_:
+        core.Main.msg.error_message(f"Checkpoint not written, since the input was not fully processed: {path}")
+        return
+    checkpoint = {
+        'version': VERSION,
+        'plugin': bridge.Plugin.identify(),
+        'lines': Checkpoint.lines_,
+        'hash': Checkpoint.hash_.hexdigest(),
+        'totals': bridge.Plugin.get_checkpoint()
+    }
+    # write a new file first, so a failed write keeps the old checkpoint
+    try:
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        core.Main.msg.error_message(f"Cannot write checkpoint: {path}")
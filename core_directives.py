@@ -13,13 +13,16 @@
 # See the LICENSE file in the project root for more information.
 ################################################################################
 
+import collections
 import fileinput
+import functools
 import glob
 import re
 import traceback
 
 import core
 import bridge
+import core_checkpoint
 import core_functions
 import var_functions
 
@@ -29,14 +32,11 @@ import var_functions
 
 def process_data_from_directive(filenames):
     try:
-        for filename in filenames:
-            f = open(filename, 'r', encoding='utf-8')
-            f_input = f.readlines()
-            f.close()
-            for line in f_input:
-                line = re.sub('\n', '', line)
-                if not core_functions.skip_line(line):
-                    bridge.Plugin.parse_line(line)
+        for line in core_checkpoint.input_lines(read_lines(filenames)):
+            line = line.rstrip('\n')
+            if not core_functions.skip_line(line):
+                bridge.Plugin.parse_line(line)
+        core_checkpoint.save()
     except FileNotFoundError as e:
         core.Main.msg.error_message(f"cli: Input file not found: {e.filename}")
     except IndexError:
@@ -51,17 +51,28 @@ def process_data_from_directive(filenames):
     finally:
         fileinput.close()
 
+def read_lines(filenames):
+    for filename in filenames:
+        f = open(filename, 'r', encoding='utf-8')
+        f_input = f.readlines()
+        f.close()
+        yield from f_input
+
 ################################################################################
 # core class to handle parsing
 ################################################################################
 
+DIRECTIVE_RE = re.compile(r'\s*&')
+
 class DirectiveParser:
     # parser class to be set up as an object that can be used by plugins
 
     def __init__(self):
+        self.action = None
         self.arg = None
         self.argtrim = None
         self.cmd = None
+        self.directive = None
         self.done = True
         self.line = None
         self.m = None
@@ -73,7 +84,7 @@ class DirectiveParser:
     def is_directive(self, line):
         # check whether the input line is calling a directive
 
-        return re.search(r'^\s*&', line)
+        return DIRECTIVE_RE.match(line)
 
     ########################################
 
@@ -91,23 +102,11 @@ class DirectiveParser:
 
     ########################################
 
-    def parse_setting(self, setting, arg):
-        # standardized parsing of the &set directive
+    def parse_setting(self, setting, arg): # pylint: disable=unused-argument
+        # standardized parsing of the &set directive (see split_setting)
         # the calling function guarantees a value parameter
 
-        # &set <setting> "<value>"
-        m = re.search(r'^.*' + setting + r'\s\"(.*)\"$', arg)
-
-        # &set <setting> '<value>'
-        if m is None:
-            m = re.search(r'^.*' + setting + r'\s\'(.*)\'$', arg)
-
-        # &set <setting> <value>
-        if m is None:
-            m = re.search(r'^.*' + setting + r'\s(.*)$', arg)
-
-        # return the value
-        return m.group(1)
+        return split_setting(arg)[1]
 
     ########################################
 
@@ -146,515 +145,675 @@ class DirectiveParser:
     def pre_parse_directive(self, line):
         # parse core directives (before plugins parse their own directives)
 
+        directive = tokenize_directive(line)
         self.line = line
-        arg = None
-        argtrim = None
-        options = []
-        m = re.search(r'^\s*\S(cli)\s(.*)$', line)
-        if m is not None:
+        self.directive = directive
+        self.cmd = directive.cmd
+        self.action = directive.action
+        self.arg = directive.arg
+        self.argtrim = directive.argtrim
+        self.options = list(directive.options)
+        self.m = None
+        self.done = True
+
+        handler = DIRECTIVES.get(self.cmd)
+        if handler is None:
+            self.done = False
+        else:
+            handler(self)
+
+    ########################################
+
+    def dispatch(self, directives):
+        # run a plugin directive from its registry (after pre_parse_directive)
+
+        handler = directives.get(self.cmd)
+        if handler is None:
+            self.invalid_directive()
+        else:
+            handler(self)
+
+################################################################################
+# tokenize a directive line once
+#
+#    - The command, action, argument and leading options are split out into
+#      a Directive record, which is cached for lines that repeat (e.g., in
+#      loops or reused &read files).
+#    - Options are stripped with string operations; options that look like
+#      regular expressions fall back to the original re.sub behavior.
+################################################################################
+
+Directive = collections.namedtuple('Directive', ['cmd', 'action', 'arg', 'argtrim', 'options'])
+
+CLI_RE = re.compile(r'^\s*\S(cli)\s(.*)$')
+ARG_RE = re.compile(r'^\s*\S(\S*)\s(.*)$')
+CMD_RE = re.compile(r'^\s*\S(\S*)$')
+REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+@functools.lru_cache(maxsize=4096)
+def tokenize_directive(line):
+    arg = None
+    argtrim = None
+    options = []
+    m = CLI_RE.search(line)
+    if m is not None:
+        arg = m.group(2)
+        argtrim = arg.strip()
+    else:
+        m = ARG_RE.search(line)
+        if m:
             arg = m.group(2)
             argtrim = arg.strip()
-        else:
-            m = re.search(r'^\s*\S(\S*)\s(.*)$', line)
-            if m:
-                arg = m.group(2)
-                argtrim = arg.strip()
-                while arg.startswith('-'):
-                    options.append(argtrim.split()[0])
+            while arg.startswith('-'):
+                option = argtrim.split()[0]
+                options.append(option)
+                if REGEX_CHARS.isdisjoint(option) and arg.startswith(option) and argtrim.startswith(option):
                     # trim the option and remove one space after it
-                    arg = re.sub(r'^\s*' + options[-1], '', arg)
-                    arg = re.sub(r'^\s', '', arg)
+                    arg = arg[len(option):]
+                    if arg[:1].isspace():
+                        arg = arg[1:]
                     # trim the option and remove all spaces after it
-                    argtrim = re.sub(r'^' + options[-1], '', argtrim)
+                    argtrim = argtrim[len(option):].lstrip()
+                else:
+                    arg = re.sub(r'^\s*' + option, '', arg)
+                    arg = re.sub(r'^\s', '', arg)
+                    argtrim = re.sub(r'^' + option, '', argtrim)
                     argtrim = argtrim.lstrip()
-                if len(options) == 0:
-                    options.append('') # insert dummy element
-            else:
-                m = re.search(r'^\s*\S(\S*)$', line)
-        cmd = m.group(1)
-        action = None
-        m = re.search(r'^([^\.]*)\.(.*)$', cmd)
-        if m is not None:
-            cmd = m.group(1)
-            action = m.group(2)
+            if len(options) == 0:
+                options.append('') # insert dummy element
+        else:
+            m = CMD_RE.search(line)
+    cmd = m.group(1)
+    action = None
+    if '.' in cmd:
+        cmd, action = cmd.split('.', 1)
+    return Directive(cmd, action, arg, argtrim, tuple(options))
 
-        ####################
+################################################################################
+# core directives
+#
+#    - Each handler is registered by name and receives the parser, with the
+#      tokenized directive in p.cmd, p.action, p.arg, p.argtrim and p.options.
+#    - Handlers set p.done = False to pass the directive on to the plugin.
+#    - Plugins keep their own DirectiveRegistry and use p.dispatch().
+################################################################################
 
-        if cmd == 'cd':
-            self.no_actions_recognized(cmd, action)
-            quiet = False
-            for option in options:
-                if option in ['-q', '--quiet']:
-                    quiet = True
-                else:
-                    core.Main.parser.unrecognized_option(option)
-            core.Main.read_path_[-1] = argtrim
-            if core.Main.read_path_[-1] and not quiet:
-                core.Main.msg.info_message(f"Setting current working directory to '{core.Main.read_path_[-1]}'.")
-            elif not quiet:
-                core.Main.msg.info_message('Resetting current working directory.')
-
-        ####################
-
-        elif cmd == 'cli':
-            self.no_actions_recognized(cmd, action)
-            if argtrim is None:
-                # mimic command line result without any parameters
-                core_functions.show_info(True)
-            else:
-                # insert placeholder
-                cli_argv = '. ' + argtrim
-                # run the options as if from the command line
-                filenames = core.Main.parser.parse_options(cli_argv.split())
-                process_data_from_directive(filenames)
-
-        ####################
-
-        elif cmd == 'goto':
-            self.no_actions_recognized(cmd, action)
-            quiet = False
-            for option in options:
-                if option in ['-q', '--quiet']:
-                    quiet = True
-                else:
-                    core.Main.parser.unrecognized_option(option)
-            core.Main.goto_[-1] = argtrim
-            if argtrim and not quiet:
-                core.Main.msg.info_message(f"Skipping to '{core.Main.goto_[-1]}'.")
-            elif not quiet:
-                self.invalid_usage('&goto <label>')
-
-        ####################
-
-        elif cmd == 'header':
-            self.no_actions_recognized(cmd, action)
-            if argtrim:
-                core.Main.elements_ = core_functions.get_elements(argtrim)
-                core.Main.headers_[-1] = core_functions.make_headers()
-            if core.Main.headers_[-1]:
-                core.Main.header_mode_ = True
-                print_header = True
-                for option in options:
-                    if option in ['-q', '--quiet']:
-                        print_header = False
-                    else:
-                        core.Main.parser.unrecognized_option(option)
-                if print_header:
-                    headers = '  '.join(core.Main.headers_[-1])
-                    if not bridge.Plugin.identify() in core.Main.does_not_process_data:
-                        # this plugin processes data
-                        bridge.Plugin.parse_line(headers)
-                    else:
-                        # this plugin does not process data
-                        # plugins/shell.py is an example
-                        out = core_functions.pre_parse(headers)
-                        if core.Main.output_[-1] and out is not None:
-                            core_functions.print_line(out)
+class DirectiveRegistry(dict):
+    # map directive names to handlers
+
+    def register(self, *names):
+        def decorate(handler):
+            for name in names:
+                self[name] = handler
+            return handler
+        return decorate
+
+DIRECTIVES = DirectiveRegistry()
+
+####################
+
+@DIRECTIVES.register('cd')
+def directive_cd(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    quiet = False
+    for option in p.options:
+        if option in ['-q', '--quiet']:
+            quiet = True
+        else:
+            core.Main.parser.unrecognized_option(option)
+    core.Main.read_path_[-1] = p.argtrim
+    if core.Main.read_path_[-1] and not quiet:
+        core.Main.msg.info_message(f"Setting current working directory to '{core.Main.read_path_[-1]}'.")
+    elif not quiet:
+        core.Main.msg.info_message('Resetting current working directory.')
+
+####################
+
+@DIRECTIVES.register('cli')
+def directive_cli(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    if p.argtrim is None:
+        # mimic command line result without any parameters
+        core_functions.show_info(True)
+    else:
+        # insert placeholder
+        cli_argv = '. ' + p.argtrim
+        # run the options as if from the command line (--checkpoint and
+        # --resume-from only apply to the files given here)
+        saved = core_checkpoint.suspend()
+        filenames = core.Main.parser.parse_options(cli_argv.split())
+        process_data_from_directive(filenames)
+        core_checkpoint.restore(saved)
+
+####################
+
+@DIRECTIVES.register('goto')
+def directive_goto(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    quiet = False
+    for option in p.options:
+        if option in ['-q', '--quiet']:
+            quiet = True
+        else:
+            core.Main.parser.unrecognized_option(option)
+    core.Main.goto_[-1] = p.argtrim
+    if p.argtrim and not quiet:
+        core.Main.msg.info_message(f"Skipping to '{core.Main.goto_[-1]}'.")
+    elif not quiet:
+        p.invalid_usage('&goto <label>')
+
+####################
+
+@DIRECTIVES.register('header')
+def directive_header(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    if p.argtrim:
+        core.Main.elements_ = core_functions.get_elements(p.argtrim)
+        core.Main.headers_[-1] = core_functions.make_headers()
+    if core.Main.headers_[-1]:
+        core.Main.header_mode_ = True
+        print_header = True
+        for option in p.options:
+            if option in ['-q', '--quiet']:
+                print_header = False
             else:
-                core.Main.msg.error_message('No header information found.')
-
-        ####################
-
-        elif cmd == 'help':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            core_functions.show_help(argtrim)
-
-        ####################
-
-        elif cmd == 'identify':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            core.Main.msg.info_message(f"Loaded plugin: {bridge.Plugin.identify()}")
-
-        ####################
-
-        elif cmd == 'map':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            show_usage = False
-            if argtrim:
-                premap = core_functions.get_elements(argtrim)
-                core.Main.map_[-1] = [None] * len(premap)
-                try:
-                    for m, element in enumerate(premap):
-                        core.Main.map_[-1][int(premap[m]) - 1] = m + 1
-                    core.Main.msg.info_message('Fields were remapped.')
-                except ValueError:
-                    show_usage = True
+                core.Main.parser.unrecognized_option(option)
+        if print_header:
+            headers = '  '.join(core.Main.headers_[-1])
+            if not bridge.Plugin.identify() in core.Main.does_not_process_data:
+                # this plugin processes data
+                bridge.Plugin.parse_line(headers)
             else:
-                show_usage = True
-            if show_usage:
-                self.invalid_usage('&map <int><space><space><int>...')
-
-        ####################
-
-        elif cmd == 'output' and arg == 'on':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            core.Main.output_[-1] = True
-            core.Main.msg.info_message('Output mode is on.')
-        elif cmd == 'output' and arg == 'off':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            core.Main.msg.info_message('Output mode is off.')
-            core.Main.output_[-1] = False
-        elif cmd == 'output':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            self.invalid_usage('&output on|off')
-
-        ####################
-
-        elif cmd == 'print':
-            self.no_actions_recognized(cmd, action)
-            self.done = False
-            if argtrim and argtrim.startswith('"'):
-                # leading double quote
-                argtrim = argtrim[1:]
-                arg = argtrim
-                if argtrim.endswith('"'):
-                    # optional matching double quote
-                    argtrim = argtrim[:-1]
-                    arg = argtrim
-            for option in options:
-                if option in ['-f', '--force']:
-                    # force print
-                    core_functions.print_line(arg)
-                    self.done = True
-                else:
-                    core.Main.parser.unrecognized_option(option)
-            if not self.done:
-                if core.Main.output_[-1]:
-                    if arg is not None:
-                        core_functions.print_line(arg)
-                    else:
-                        core_functions.print_line()
-                else:
-                    pass
-            self.done = True
-
-        ####################
-
-        elif cmd == 'read':
-            self.no_actions_recognized(cmd, action)
-            if argtrim:
-                quiet_mode = False
-                for option in options:
-                    if option in ['-i', '--inline']:
-                        core.Main.read_inline_ = True
-                    elif option in ['-s', '--sandbox']:
-                        core.Main.read_inline_ = False
-                    elif option in ['-q', '--quiet']:
-                        quiet_mode = True
-                    else:
-                        core.Main.parser.unrecognized_option(option)
-                read_source = argtrim
-                read_sources = read_source.split(' ')
-                s = 's' if len(read_sources) > 1 else ''
-                inline = ' (inline mode)' if core.Main.read_inline_ else ''
-                if core.Main.read_path_[-1]:
-                    for i, rs in enumerate(read_sources):
-                        read_sources[i] = core.Main.read_path_[-1] + '/' + rs
-                if core.Main.max_read_depth_ > 0:
-                    core.Main.max_read_depth_ = core.Main.max_read_depth_ - 1
-                    if not quiet_mode:
-                        core.Main.msg.info_message(f"Reading file{s}: {read_source}{inline}")
-                    core_functions.push_env()
-                    try:
-                        with fileinput.FileInput(files=(read_sources), mode='r') as read_lines:
-                            for read_line in read_lines:
-                                read_line = re.sub('\n', '', read_line)
-                                if not core_functions.skip_line(read_line):
-                                    bridge.Plugin.parse_line(read_line)
-                                var_functions.process_release()
-                                if not core.Main.running_[-1]:
-                                    break
-                    except FileNotFoundError as e:
-                        core.Main.msg.error_message(f"{cmd}: Input file not found: {e.filename}")
-                    except IndexError:
-                        core.Main.msg.error_message(f"{cmd}: Badly formed data: {read_line}", True)
-                    except ValueError:
-                        core.Main.msg.error_message(f"{cmd}: Invalid input: {read_line}", True)
-                    except: # pylint: disable=bare-except
-                        core.Main.msg.error_message(f"{cmd}: Unexpected error.", True)
-                        traceback.print_exc()
-                    finally:
-                        if core.Testing.testing_[-1]:
-                            core.Testing.testStop()
-                        core_functions.pop_env()
-                        if not quiet_mode:
-                            core.Main.msg.info_message(f"Finished reading file{s}: {read_source}{inline}")
-                    core.Main.max_read_depth_ = core.Main.max_read_depth_ + 1
-                else:
-                    core.Main.msg.error_message(f"{cmd}: Nested level too deep; will not read {read_source}.")
+                # this plugin does not process data
+                # plugins/shell.py is an example
+                out = core_functions.pre_parse(headers)
+                if core.Main.output_[-1] and out is not None:
+                    core_functions.print_line(out)
+    else:
+        core.Main.msg.error_message('No header information found.')
+
+####################
+
+@DIRECTIVES.register('help')
+def directive_help(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    core_functions.show_help(p.argtrim)
+
+####################
+
+@DIRECTIVES.register('identify')
+def directive_identify(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    core.Main.msg.info_message(f"Loaded plugin: {bridge.Plugin.identify()}")
+
+####################
+
+@DIRECTIVES.register('map')
+def directive_map(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    show_usage = False
+    if p.argtrim:
+        premap = core_functions.get_elements(p.argtrim)
+        core.Main.map_[-1] = [None] * len(premap)
+        try:
+            for m, element in enumerate(premap):
+                core.Main.map_[-1][int(premap[m]) - 1] = m + 1
+            core.Main.msg.info_message('Fields were remapped.')
+        except ValueError:
+            show_usage = True
+    else:
+        show_usage = True
+    if show_usage:
+        p.invalid_usage('&map <int><space><space><int>...')
+
+####################
+
+@DIRECTIVES.register('output')
+def directive_output(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    if p.arg == 'on':
+        core.Main.output_[-1] = True
+        core.Main.msg.info_message('Output mode is on.')
+    elif p.arg == 'off':
+        core.Main.msg.info_message('Output mode is off.')
+        core.Main.output_[-1] = False
+    else:
+        p.invalid_usage('&output on|off')
+
+####################
+
+@DIRECTIVES.register('print')
+def directive_print(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    p.done = False
+    arg = p.arg
+    argtrim = p.argtrim
+    if argtrim and argtrim.startswith('"'):
+        # leading double quote
+        argtrim = argtrim[1:]
+        arg = argtrim
+        if argtrim.endswith('"'):
+            # optional matching double quote
+            argtrim = argtrim[:-1]
+            arg = argtrim
+    for option in p.options:
+        if option in ['-f', '--force']:
+            # force print
+            core_functions.print_line(arg)
+            p.done = True
+        else:
+            core.Main.parser.unrecognized_option(option)
+    if not p.done:
+        if core.Main.output_[-1]:
+            if arg is not None:
+                core_functions.print_line(arg)
             else:
-                self.invalid_usage('&read <filenames>')
-
-        ####################
-
-        elif cmd == 'set':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            show_usage = False
-            if argtrim:
-                parts = argtrim.split()
-                if len(parts) > 1:
-                    if parts[0] == 'currency':
-                        core.Main.currency_format_ = self.parse_setting('currency', arg)
-                    elif parts[0] == 'percentage':
-                        core.Main.percentage_format_ = self.parse_setting('percentage', arg)
-                    elif parts[0] == 'margin':
-                        core.Main.margin_ = self.parse_setting('margin', arg)
-                    elif parts[0] == 'prompt':
-                        core.Main.interactive_prompt_ = self.parse_setting('prompt', arg)
-                    else:
-                        show_usage = True
+                core_functions.print_line()
+    p.arg = arg
+    p.argtrim = argtrim
+    p.done = True
+
+####################
+
+@DIRECTIVES.register('read')
+def directive_read(p): # pylint: disable=too-many-branches
+    cmd = p.cmd
+    p.no_actions_recognized(cmd, p.action)
+    if p.argtrim:
+        quiet_mode = False
+        for option in p.options:
+            if option in ['-i', '--inline']:
+                core.Main.read_inline_ = True
+            elif option in ['-s', '--sandbox']:
+                core.Main.read_inline_ = False
+            elif option in ['-q', '--quiet']:
+                quiet_mode = True
             else:
-                show_usage = True
-            if show_usage:
-                self.done = False
-                self.usage = '&set [ prompt <string> ]'
-
-        ####################
-
-        elif cmd == 'stop':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-
-            # --ignore-stop: continue reading data and ignore the &stop directive
-            # otherwise, stop testing and stop running
-            if not core.Cli.ignore_stop_:
+                core.Main.parser.unrecognized_option(option)
+        read_source = p.argtrim
+        read_sources = read_source.split(' ')
+        s = 's' if len(read_sources) > 1 else ''
+        inline = ' (inline mode)' if core.Main.read_inline_ else ''
+        if core.Main.read_path_[-1]:
+            for i, rs in enumerate(read_sources):
+                read_sources[i] = core.Main.read_path_[-1] + '/' + rs
+        if core.Main.max_read_depth_ > 0:
+            core.Main.max_read_depth_ = core.Main.max_read_depth_ - 1
+            if not quiet_mode:
+                core.Main.msg.info_message(f"Reading file{s}: {read_source}{inline}")
+            core_functions.push_env()
+            try:
+                with fileinput.FileInput(files=(read_sources), mode='r') as read_lines:
+                    for read_line in read_lines:
+                        read_line = read_line.rstrip('\n')
+                        if not core_functions.skip_line(read_line):
+                            bridge.Plugin.parse_line(read_line)
+                        var_functions.process_release()
+                        if not core.Main.running_[-1]:
+                            break
+            except FileNotFoundError as e:
+                core.Main.msg.error_message(f"{cmd}: Input file not found: {e.filename}")
+            except IndexError:
+                core.Main.msg.error_message(f"{cmd}: Badly formed data: {read_line}", True)
+            except ValueError:
+                core.Main.msg.error_message(f"{cmd}: Invalid input: {read_line}", True)
+            except: # pylint: disable=bare-except
+                core.Main.msg.error_message(f"{cmd}: Unexpected error.", True)
+                traceback.print_exc()
+            finally:
                 if core.Testing.testing_[-1]:
                     core.Testing.testStop()
-                core.Main.running_[-1] = False
+                core_functions.pop_env()
+                if not quiet_mode:
+                    core.Main.msg.info_message(f"Finished reading file{s}: {read_source}{inline}")
+            core.Main.max_read_depth_ = core.Main.max_read_depth_ + 1
+        else:
+            core.Main.msg.error_message(f"{cmd}: Nested level too deep; will not read {read_source}.")
+    else:
+        p.invalid_usage('&read <filenames>')
+
+####################
+
+@DIRECTIVES.register('set')
+def directive_set(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    name, value = split_setting(p.arg) if p.argtrim else (None, None)
+    plugin_settings = bridge.Plugin.settings
+    setting = SETTINGS.get(name)
+    if setting is None and plugin_settings is not None:
+        setting = plugin_settings.get(name)
+    if setting is not None and len(p.argtrim.split()) > 1:
+        setting.set(value)
+        return
+    p.usage = SETTINGS.usage()
+    if plugin_settings is None:
+        # plugins without a settings registry parse &set themselves
+        p.done = False
+    else:
+        p.invalid_usage(plugin_settings.usage() if plugin_settings else None)
 
-            # --ignore-stop-reset: same as --ignore-stop, but also reset all running values
-            if core.Cli.ignore_stop_reset_:
-                if core.Testing.testing_[-1]:
-                    core.Testing.testStop()
-                core.reset()
-                core.Testing.reset()
-                bridge.Plugin.reset()
-
-        ####################
-
-        elif cmd == 'timer':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            if argtrim is not None:
-                label = ''
-                mode = None
-                for element in argtrim.split():
-                    if element in ['start', 'stop']:
-                        mode = element
-                    else:
-                        label = element
-                if mode == 'start':
-                    core_functions.timer_start(label)
-                elif mode == 'stop':
-                    core_functions.timer_stop()
+################################################################################
+# settings for the &set directive
+#
+#    - Each setting is registered with a name, a value type and a handler.
+#    - Values may be quoted with matching double or single quotes.
+#    - Plugins keep their own SettingRegistry in SETTINGS, which &set checks
+#      after the core settings.
+################################################################################
+
+SETTING_RE = re.compile(r'(\S+)\s(.*)$')
+
+def split_setting(arg):
+    # split '<setting> <value>' into the setting name and its value
+    m = SETTING_RE.match(arg.lstrip())
+    if m is None:
+        return arg.strip(), None
+    name, value = m.groups()
+    if len(value) > 1 and value[0] in '"\'' and value[-1] == value[0]:
+        value = value[1:-1]
+    return name, value
+
+class Setting():
+    # a named setting with a value type and a handler
+
+    def __init__(self, name, kind, handler, usage):
+        self.name = name
+        self.kind = kind
+        self.handler = handler
+        self.usage = usage
+
+    def set(self, value):
+        # a value of the wrong kind raises ValueError, which stops the input
+        # with "Invalid input", as for any other bad line
+        self.handler(self.kind(value))
+
+class SettingRegistry(dict):
+    # map setting names to settings
+
+    def register(self, name, kind = str, usage = '<string>'):
+        def decorate(handler):
+            self[name] = Setting(name, kind, handler, usage)
+            return handler
+        return decorate
+
+    def usage(self):
+        return '&set [ ' + ' | '.join(f"{s.name} {s.usage}" for s in self.values()) + ' ]'
+
+SETTINGS = SettingRegistry()
+
+@SETTINGS.register('currency')
+def setting_currency(value):
+    core.Main.currency_format_ = value
+
+@SETTINGS.register('percentage')
+def setting_percentage(value):
+    core.Main.percentage_format_ = value
+
+@SETTINGS.register('margin')
+def setting_margin(value):
+    core.Main.margin_ = value
+
+@SETTINGS.register('prompt')
+def setting_prompt(value):
+    core.Main.interactive_prompt_ = value
+
+@SETTINGS.register('dateformat-in', usage = '<format>|auto')
+def setting_dateformat_in(value):
+    # strptime format tried first for '@' fields and date values
+    core.Main.date_format_in_ = None if value == 'auto' else value
+
+####################
+
+@DIRECTIVES.register('stop')
+def directive_stop(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+
+    # --ignore-stop: continue reading data and ignore the &stop directive
+    # otherwise, stop testing and stop running
+    if not core.Cli.ignore_stop_:
+        if core.Testing.testing_[-1]:
+            core.Testing.testStop()
+        core.Main.running_[-1] = False
+        core.Main.writer.flush()
+
+    # --ignore-stop-reset: same as --ignore-stop, but also reset all running values
+    if core.Cli.ignore_stop_reset_:
+        if core.Testing.testing_[-1]:
+            core.Testing.testStop()
+        core.reset()
+        core.Testing.reset()
+        bridge.Plugin.reset()
+
+####################
+
+@DIRECTIVES.register('timer')
+def directive_timer(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    if p.argtrim is not None:
+        label = ''
+        mode = None
+        for element in p.argtrim.split():
+            if element in ['start', 'stop']:
+                mode = element
             else:
-                core_functions.timer_status()
-
-        ####################
-
-        elif cmd == 'use':
-            self.no_actions_recognized(cmd, action)
-            if argtrim is not None:
-                quiet = False
-                for option in options:
-                    if option in ['-q']:
-                        quiet = True
-                    else:
-                        core.Main.parser.unrecognized_option(option)
-                core.reset(False)
-                core_functions.use_plugin(argtrim)
-                if not quiet:
-                    DirectiveParser().parse_directive('&identify')
+                label = element
+        if mode == 'start':
+            core_functions.timer_start(label)
+        elif mode == 'stop':
+            core_functions.timer_stop()
+    else:
+        core_functions.timer_status()
+
+####################
+
+@DIRECTIVES.register('use')
+def directive_use(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    if p.argtrim is not None:
+        quiet = False
+        for option in p.options:
+            if option in ['-q']:
+                quiet = True
             else:
-                DirectiveParser().parse_directive('&identify')
-                plugins = glob.glob(core.Main.source_path_ + '/plugins/*.py')
-                plugins.sort()
-                other_plugins = ''
-                current_plugin = bridge.Plugin.identify()
-                for plugin in plugins:
-                    m = re.search(r'^.*\/([\S\s]*).py', plugin)
-                    name = m.group(1)
-                    if name != current_plugin:
-                        other_plugins += name + '  '
-                core.Main.msg.info_message(f"Also available:  {other_plugins.strip()}")
-
-        ####################
-
-        elif cmd == 'var':
-            core.Main.until_quiet_ = False
-            if action is not None:
-                if not var_functions.var_action(action, argtrim, options):
-                    self.unrecognized_action(cmd, action)
-            if argtrim is not None and action is None:
-                m = re.search(r'^(.*)\s(-+[-\sa-zA-Z0-9]*)$', argtrim)
-                if m is not None:
-                    options += m.group(2).split()
-                    argtrim = m.group(1)
-                parts = argtrim.split()
-                var_key = parts[0]
-                var_values = []
-                m = re.search(r'^[^\s]+\s+(.*)$', argtrim)
-                if m is not None:
-                    var_values = var_functions.get_values(m.group(1))
-                if var_values is not None:
-                    has_var_values = len(var_values) >= 1
-                else:
-                    has_var_values = False
-                should_set_var = True
-                should_show_var_only = True
-                should_defer_show = False
-                append = False
+                core.Main.parser.unrecognized_option(option)
+        core.reset(False)
+        core_functions.use_plugin(p.argtrim)
+        if not quiet:
+            DirectiveParser().parse_directive('&identify')
+    else:
+        DirectiveParser().parse_directive('&identify')
+        plugins = glob.glob(core.Main.source_path_ + '/plugins/*.py')
+        plugins.sort()
+        other_plugins = ''
+        current_plugin = bridge.Plugin.identify()
+        for plugin in plugins:
+            m = re.search(r'^.*\/([\S\s]*).py', plugin)
+            name = m.group(1)
+            if name != current_plugin:
+                other_plugins += name + '  '
+        core.Main.msg.info_message(f"Also available:  {other_plugins.strip()}")
+
+####################
+
+@DIRECTIVES.register('var')
+def directive_var(p): # pylint: disable=too-many-branches
+    action = p.action
+    argtrim = p.argtrim
+    options = p.options
+    core.Main.until_quiet_ = False
+    if action is not None:
+        if not var_functions.var_action(action, argtrim, options):
+            p.unrecognized_action(p.cmd, action)
+    if argtrim is not None and action is None:
+        m = re.search(r'^(.*)\s(-+[-\sa-zA-Z0-9]*)$', argtrim)
+        if m is not None:
+            options += m.group(2).split()
+            argtrim = m.group(1)
+        parts = argtrim.split()
+        var_key = parts[0]
+        var_values = []
+        m = re.search(r'^[^\s]+\s+(.*)$', argtrim)
+        if m is not None:
+            var_values = var_functions.get_values(m.group(1))
+        if var_values is not None:
+            has_var_values = len(var_values) >= 1
+        else:
+            has_var_values = False
+        should_set_var = True
+        should_show_var_only = True
+        should_defer_show = False
+        append = False
+        skip = False
+        for i, option in enumerate(options):
+            if skip:
                 skip = False
-                for i, option in enumerate(options):
-                    if skip:
-                        skip = False
-                        continue
-                    if option in ['-A', '--append'] and has_var_values:
-                        var_functions.push_var(var_key, var_values)
-                        should_set_var = False
-                    elif option in ['-A', '--append'] and not has_var_values:
-                        append = True
-                    elif option in ['-D', '--duplicate']:
-                        var_functions.dup_var(var_key, var_values)
-                        should_set_var = False
-                        should_show_var_only = False
-                    elif option in ['-p', '--pop']:
-                        var_functions.pop_var(var_key)
-                    elif option in ['-q', '--quiet']:
-                        core.Main.until_quiet_ = True
-                    elif option in ['--until']:
-                        if not append:
-                            var_functions.del_var([var_key])
-                        should_set_var = False
-                        should_defer_show = True
-                        skip = True
-                        core.Main.until_ = options[i+1]
-                        core.Main.until_var_key_ = var_key
-                        core.Main.parser.freeze_history()
-                    elif option in ['-x', '--delete']:
-                        var_functions.del_var([var_key] + var_values)
-                        should_set_var = False
-                        should_show_var_only = False
-                if should_set_var and has_var_values:
-                    var_functions.set_var(var_key, var_values)
-                if should_show_var_only and not should_defer_show:
-                    core.Main.msg.info_message(var_functions.show_var(var_key))
-                elif not should_defer_show:
-                    for key in [var_key] + var_values:
-                        core.Main.msg.info_message(var_functions.show_var(key))
-            elif action is None:
-                core.Main.msg.info_message(var_functions.show_all_vars())
-
-        ####################
-
-        elif cmd == 'test' and core.Cli.skip_testing_:
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-        elif cmd == 'test':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            if argtrim is None:
-                core.Testing.testMessage(f"Usage: &{cmd} <parameters>")
-            elif argtrim.startswith('start '):
-                if not core.Testing.testing_[-1]:
-                    m = re.search(r'^start\s+(\S*)$', argtrim)
-                    if m:
-                        core.Testing.test_filename_[-1] = m.group(1)
-                        core.Testing.testing_[-1] = True
-                        core.Testing.test_pause_[-1] = False
-                        core.Testing.test_pass_[-1] = 0
-                        core.Testing.test_fail_[-1] = 0
-                        core.Testing.testMessage(f"Test started with {core.Testing.test_filename_[-1]}")
-                    else:
-                        core.Testing.testMessage('Test filename not specified.')
-                else:
-                    core.Testing.testMessage(f"Test is already running ({core.Testing.test_filename_[-1]}).")
-            elif argtrim == 'pause':
-                if core.Testing.testing_[-1]:
-                    core.Testing.test_pause_[-1] = True
-                    core.Testing.testMessage('Test paused.')
-                else:
-                    core.Testing.testMessage('No test is currently running.')
-            elif argtrim == 'resume':
-                if core.Testing.testing_[-1]:
-                    core.Testing.test_pause_[-1] = False
-                    core.Testing.testMessage('Test resumed.')
-                else:
-                    core.Testing.testMessage('No test is currently running.')
-            elif argtrim == 'verbose':
-                if not core.Cli.test_force_quiet_:
-                    core.Testing.test_verbose_[-1] = True
-                    core.Testing.testMessage('Test mode set to verbose.')
-            elif argtrim.startswith('versions '):
-                m = re.search(r'^versions\s+(.*)$', argtrim)
-                if m:
-                    version_range = m.group(1)
-                    core.Testing.testVersions(version_range)
-                else:
-                    core.Testing.testMessage('Version range not specified.')
-            elif argtrim == 'quiet':
-                if not core.Cli.test_force_verbose_:
-                    core.Testing.test_verbose_[-1] = False
-                    core.Testing.testMessage('Test mode set to quiet.')
-            elif argtrim == 'stop':
-                core.Testing.testStop()
+                continue
+            if option in ['-A', '--append'] and has_var_values:
+                var_functions.push_var(var_key, var_values)
+                should_set_var = False
+            elif option in ['-A', '--append'] and not has_var_values:
+                append = True
+            elif option in ['-D', '--duplicate']:
+                var_functions.dup_var(var_key, var_values)
+                should_set_var = False
+                should_show_var_only = False
+            elif option in ['-p', '--pop']:
+                var_functions.pop_var(var_key)
+            elif option in ['-q', '--quiet']:
+                core.Main.until_quiet_ = True
+            elif option in ['--until']:
+                if not append:
+                    var_functions.del_var([var_key])
+                should_set_var = False
+                should_defer_show = True
+                skip = True
+                core.Main.until_ = options[i+1]
+                core.Main.until_var_key_ = var_key
+                core.Main.parser.freeze_history()
+            elif option in ['-x', '--delete']:
+                var_functions.del_var([var_key] + var_values)
+                should_set_var = False
+                should_show_var_only = False
+        if should_set_var and has_var_values:
+            var_functions.set_var(var_key, var_values)
+        if not (core.Main.infomsg_[-1] and core.Main.output_[-1]):
+            pass # don't format variables (which can be long) for messages that won't show
+        elif should_show_var_only and not should_defer_show:
+            core.Main.msg.info_message(var_functions.show_var(var_key))
+        elif not should_defer_show:
+            for key in [var_key] + var_values:
+                core.Main.msg.info_message(var_functions.show_var(key))
+        p.argtrim = argtrim
+    elif action is None:
+        core.Main.msg.info_message(var_functions.show_all_vars())
+
+####################
+
+@DIRECTIVES.register('test')
+def directive_test(p): # pylint: disable=too-many-branches
+    cmd = p.cmd
+    argtrim = p.argtrim
+    p.no_actions_recognized(cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    if core.Cli.skip_testing_:
+        return
+    if argtrim is None:
+        core.Testing.testMessage(f"Usage: &{cmd} <parameters>")
+    elif argtrim.startswith('start '):
+        if not core.Testing.testing_[-1]:
+            m = re.search(r'^start\s+(\S*)$', argtrim)
+            if m:
+                core.Testing.test_filename_[-1] = m.group(1)
+                core.Testing.testing_[-1] = True
+                core.Testing.test_pause_[-1] = False
+                core.Testing.test_pass_[-1] = 0
+                core.Testing.test_fail_[-1] = 0
+                core.Testing.testMessage(f"Test started with {core.Testing.test_filename_[-1]}")
             else:
-                core.Testing.testMessage(f"{cmd}: invalid parameter(s) '{argtrim}'")
-
-
-        ####################
-
-        elif cmd == 'env':
-            self.no_actions_recognized(cmd, action)
-            core.Main.parser.no_options_recognized(options)
-            if argtrim == 'push':
-                core_functions.push_env()
-            elif argtrim == 'pop':
-                core_functions.pop_env()
-
-        ####################
-
-        elif cmd == 'debug':
-            self.no_actions_recognized(cmd, action)
-            fullname = False
-            for option in options:
-                if option in ['-fn', '--full-name']:
-                    fullname = True
-                else:
-                    core.Main.parser.unrecognized_option(option)
-            core.Testing.debug(argtrim, fullname)
-
-        ####################
-
-        elif cmd == 'infomsg' and arg == 'on':
-            self.no_actions_recognized(cmd, action)
-            quiet = False
-            for option in options:
-                if option in ['-q']:
-                    quiet = True
-                else:
-                    core.Main.parser.unrecognized_option(option)
-            core.Main.infomsg_[-1] = True
-            if not quiet:
-                core.Main.msg.info_message('Infomsg mode is on.')
-        elif cmd == 'infomsg' and arg == 'off':
-            self.no_actions_recognized(cmd, action)
-            core.Main.infomsg_[-1] = False
-
-        ####################
-
+                core.Testing.testMessage('Test filename not specified.')
         else:
-            self.done = False
-
-        self.arg = arg
-        self.argtrim = argtrim
-        self.cmd = cmd
-        self.m = m
-        self.options = options
+            core.Testing.testMessage(f"Test is already running ({core.Testing.test_filename_[-1]}).")
+    elif argtrim == 'pause':
+        if core.Testing.testing_[-1]:
+            core.Testing.test_pause_[-1] = True
+            core.Testing.testMessage('Test paused.')
+        else:
+            core.Testing.testMessage('No test is currently running.')
+    elif argtrim == 'resume':
+        if core.Testing.testing_[-1]:
+            core.Testing.test_pause_[-1] = False
+            core.Testing.testMessage('Test resumed.')
+        else:
+            core.Testing.testMessage('No test is currently running.')
+    elif argtrim == 'verbose':
+        if not core.Cli.test_force_quiet_:
+            core.Testing.test_verbose_[-1] = True
+            core.Testing.testMessage('Test mode set to verbose.')
+    elif argtrim.startswith('versions '):
+        m = re.search(r'^versions\s+(.*)$', argtrim)
+        if m:
+            version_range = m.group(1)
+            core.Testing.testVersions(version_range)
+        else:
+            core.Testing.testMessage('Version range not specified.')
+    elif argtrim == 'quiet':
+        if not core.Cli.test_force_verbose_:
+            core.Testing.test_verbose_[-1] = False
+            core.Testing.testMessage('Test mode set to quiet.')
+    elif argtrim == 'stop':
+        core.Testing.testStop()
+    else:
+        core.Testing.testMessage(f"{cmd}: invalid parameter(s) '{argtrim}'")
+
+####################
+
+@DIRECTIVES.register('env')
+def directive_env(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    core.Main.parser.no_options_recognized(p.options)
+    if p.argtrim == 'push':
+        core_functions.push_env()
+    elif p.argtrim == 'pop':
+        core_functions.pop_env()
+
+####################
+
+@DIRECTIVES.register('debug')
+def directive_debug(p):
+    p.no_actions_recognized(p.cmd, p.action)
+    fullname = False
+    for option in p.options:
+        if option in ['-fn', '--full-name']:
+            fullname = True
+        else:
+            core.Main.parser.unrecognized_option(option)
+    core.Testing.debug(p.argtrim, fullname)
+
+####################
+
+@DIRECTIVES.register('infomsg')
+def directive_infomsg(p):
+    if p.arg == 'on':
+        p.no_actions_recognized(p.cmd, p.action)
+        quiet = False
+        for option in p.options:
+            if option in ['-q']:
+                quiet = True
+            else:
+                core.Main.parser.unrecognized_option(option)
+        core.Main.infomsg_[-1] = True
+        if not quiet:
+            core.Main.msg.info_message('Infomsg mode is on.')
+    elif p.arg == 'off':
+        p.no_actions_recognized(p.cmd, p.action)
+        core.Main.infomsg_[-1] = False
+    else:
+        # leave it to the plugin
+        p.done = False
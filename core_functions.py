@@ -20,10 +20,13 @@ import sys
 import textwrap
 import time
 import traceback
+from collections.abc import Mapping, MutableMapping
 from os.path import dirname, exists, realpath
 
 import core
+import core_session
 import bridge
+import testing_functions
 import var_functions
 
 ################################################################################
@@ -56,11 +59,18 @@ def format_element(index, elements):
     return format_element_by_value(index, element)
 
 def format_element_by_value(index, element):
+    formatters = core.Main.state().formatters_[-1]
+    if formatters is None:
+        return format_value(index, element)
+    return formatters[index](element)
+
+def format_value(index, element):
+    # general formatting rules for any element type (see also make_formatter)
     padding = ' '
     formats = core.Main.formats_[-1][index]
     if isinstance(element, str) and '@' in formats:
         try:
-            element = core.Main.DateUtil.parse(element).strftime(core.Main.datetime_format_)
+            element = core.Main.DateUtil.format(element)
         except ValueError:
             pass
     if is_float(element) and not is_integer(element):
@@ -84,6 +94,55 @@ def format_element_by_value(index, element):
         return rjustify(str(element), core.Main.width_[-1][index], padding) + core.Main.margin_
     return element
 
+################################################################################
+# formatter plan
+#
+#    - make_headers compiles one formatter per column, so the format flags,
+#      alignment, width and padding are looked up once per header.
+#    - String elements are formatted directly by the column formatter.
+#    - Other element types (e.g., running balances) go through format_value.
+################################################################################
+
+JUSTIFY = {'<': str.ljust, '|': str.center, '^': str.center, '>': str.rjust}
+
+def make_formatter(index, formats, align, width, padding):
+    justify = JUSTIFY.get(align)
+    if justify is None:
+        return lambda element: format_value(index, element)
+    is_date = '@' in formats
+    is_rounded = '~' in formats
+    is_currency = '$' in formats
+    is_percentage = '%' in formats and not is_currency
+    is_numeric = is_rounded or is_currency or is_percentage
+
+    def formatter(element):
+        if element.__class__ is not str:
+            return format_value(index, element)
+        main = core.Main.state()
+        if is_date:
+            try:
+                element = core.Main.DateUtil.format(element)
+            except ValueError:
+                pass
+        if is_numeric:
+            try:
+                number = float(element)
+            except ValueError:
+                number = None
+            if number is not None:
+                if is_rounded:
+                    element = str(round(number))
+                    number = float(element)
+                if is_currency:
+                    element = currency(number)
+                elif is_percentage:
+                    element = percentage(number)
+        if main.header_mode_ or element.strip() == '':
+            return justify(element, width)[:width] + main.margin_
+        return justify(element, width, padding)[:width] + main.margin_
+
+    return formatter
+
 def ljustify(content, width, padding = ' '):
     return content.ljust(width, padding)[:width]
 
@@ -177,22 +236,48 @@ def timer_elapsed(start, stop):
 #    - A dash denotes an empty data element (line_element_placeholder_).
 ################################################################################
 
-def get_elements(line):
-    # non-printable null character for internal parsing
-    delim = '\x00'
+class FieldSplitter():
+    # split lines into elements with a precompiled delimiter
+
+    def __init__(self, delimiter, placeholder):
+        self.delimiter = delimiter
+        self.placeholder = placeholder
+        self.pattern = re.compile(delimiter)
 
-    # convert the delimiter into delim and split the line into elements
-    # this approach allows multi-character delimiters
-    line = re.sub(core.Main.line_parse_delimiter_, delim, line.lstrip())
-    elements = line.split(delim)
+        # capture groups would leak into the results of re.split
+        self.grouped = self.pattern.groups > 0
 
-    # dashes are placeholders for empty fields
-    for i, element in enumerate(elements):
-        if element == core.Main.line_element_placeholder_:
-            elements[i] = ' '
+    def __repr__(self):
+        return f"FieldSplitter({self.delimiter!r}, {self.placeholder!r})"
 
-    # now we have the elements to send back
-    return elements
+    def split(self, line):
+        if self.grouped:
+            # non-printable null character for internal parsing
+            elements = self.pattern.sub('\x00', line.lstrip()).split('\x00')
+        else:
+            elements = self.pattern.split(line.lstrip())
+
+        # dashes are placeholders for empty fields
+        if self.placeholder in elements:
+            placeholder = self.placeholder
+            elements = [' ' if element == placeholder else element for element in elements]
+
+        # now we have the elements to send back
+        return elements
+
+def get_splitter():
+    # rebuild the splitter only when the delimiter or placeholder changes
+    main = core.Main.state()
+    splitter = main.splitter_
+    if splitter is None \
+            or splitter.delimiter != main.line_parse_delimiter_ \
+            or splitter.placeholder != main.line_element_placeholder_:
+        splitter = FieldSplitter(main.line_parse_delimiter_, main.line_element_placeholder_)
+        main.splitter_ = splitter
+    return splitter
+
+def get_elements(line):
+    return get_splitter().split(line)
 
 ################################################################################
 # generate header data according to specifications
@@ -204,6 +289,7 @@ def make_headers():
     core.Main.justify_[-1] = [None] * len(core.Main.elements_)
     core.Main.padding_[-1] = [None] * len(core.Main.elements_)
     core.Main.width_[-1] = [None] * len(core.Main.elements_)
+    core.Main.formatters_[-1] = [None] * len(core.Main.elements_)
 
     # iterate over header specification
     for i, element in enumerate(core.Main.elements_):
@@ -236,6 +322,9 @@ def make_headers():
             core.Main.width_[-1][i] = int(m_width)
             core.Main.padding_[-1][i] = m_padding
 
+            # compile the formatter for this column
+            core.Main.formatters_[-1][i] = make_formatter(i, m_formats, m_justify, int(m_width), m_padding)
+
         # invalid format
         else:
             return None
@@ -251,45 +340,96 @@ def make_headers():
 #    - Returns None if there is no output.
 ################################################################################
 
-def pre_parse(line):
-    # break the line down into its constituent parts
-    core.Main.elements_ = get_elements(line)
+def pre_parse(line, elements = None):
+    main = core.Main.state()
+
+    # break the line down into its constituent parts (released rows are already split)
+    main.elements_ = get_elements(line) if elements is None else elements
 
     # &var.capture
-    if core.Main.capture_mode_:
-        var_functions.push_or_set_var(core.Main.capture_key_, [core.Main.elements_])
+    if main.capture_mode_:
+        var_functions.capture_row(main.capture_key_, main.elements_)
         return None
 
     # current plugin not using headers: done, no mapping needed
-    if not core.Main.using_headers_:
+    if not main.using_headers_:
         return
 
     # if we don't have a header yet, then we need to get one now
-    if core.Main.headers_[-1] is None:
-        core.Main.headers_[-1] = make_headers()
-        core.Main.header_mode_ = True
+    if main.headers_[-1] is None:
+        main.headers_[-1] = make_headers()
+        main.header_mode_ = True
 
     # if we still don't have a header at this point, then the data is misconfigured
-    if core.Main.headers_[-1] is None:
+    if main.headers_[-1] is None:
+        if line is None:
+            line = '  '.join([element if element != ' ' else '-' for element in main.elements_])
         error_message(f"Invalid header configuration: {line}")
         return
 
     # return the header or data elements, after mapping
-    return map_elements(core.Main.elements_)
+    return map_elements(main.elements_)
 
 ################################################################################
 # map header/data elements to rearrange "columns" according to specifications
-################################################################################
+#
+#    - The visible, remapped column order is worked out once per &map or
+#      &header (see RowRenderer) and each row is rendered with a single join.
+#    - Rows that do not match the header length are mapped column by column.
+################################################################################
+
+class RowRenderer():
+    # render rows using a precomputed column order
+
+    def __init__(self, headers, mapping, formatters):
+        self.headers = headers
+        self.mapping = mapping
+        self.formatters = formatters
+        self.size = None
+        self.columns = None
+        if headers is None:
+            return
+        self.size = len(headers)
+        try:
+            self.columns = []
+            for i in range(self.size):
+                m = i
+                if mapping is not None:
+                    m = mapping[i] - 1
+                if not headers[m].startswith('#'):
+                    self.columns.append((m, formatters[m]))
+        except (IndexError, TypeError):
+            # incomplete mapping: let map_elements report it row by row
+            self.columns = None
+
+    def is_current(self, main):
+        return self.headers is main.headers_[-1] \
+            and self.mapping is main.map_[-1] \
+            and self.formatters is main.formatters_[-1]
+
+def get_renderer(main = None):
+    if main is None:
+        main = core.Main.state()
+    renderer = main.renderer_
+    if renderer is None or not renderer.is_current(main):
+        renderer = RowRenderer(main.headers_[-1], main.map_[-1], main.formatters_[-1])
+        main.renderer_ = renderer
+    return renderer
 
 def map_elements(elements):
-    out = ''
+    main = core.Main.state()
+    renderer = get_renderer(main)
+    if renderer.columns is not None and len(elements) == renderer.size:
+        return ''.join([formatter(elements[m]) for m, formatter in renderer.columns])
+    formatters = main.formatters_[-1]
+    out = []
     for i, _ in enumerate(elements):
         m = i
-        if core.Main.map_[-1] is not None:
-            m = core.Main.map_[-1][i] - 1
-        if not core.Main.headers_[-1][m].startswith('#'):
-            out += format_element(m, elements)
-    return out
+        if main.map_[-1] is not None:
+            m = main.map_[-1][i] - 1
+        if not main.headers_[-1][m].startswith('#'):
+            out.append(formatters[m](elements[m]))
+    return ''.join(out)
 
 ################################################################################
 # call use_plugin in the bridge module and catch errors
@@ -307,63 +447,96 @@ def use_plugin(plugin_name):
 # send content to the output, but run it through testing if required
 ################################################################################
 
-def print_line(line = '', stdio=sys.stdout):
-    if core.Testing.testing_[-1]:
+def print_line(line = '', stdio = None):
+    testing = core.Testing.state()
+    if testing.testing_[-1]:
         try:
-            if core.Testing.test_f_[-1] is None:
+            if core.Testing.test_comparator_[-1] is None:
                 read_source = core.Testing.test_filename_[-1]
                 if core.Main.read_path_[-1]:
                     read_source = core.Main.read_path_[-1] + '/' + core.Testing.test_filename_[-1]
                 if exists(read_source):
-                    core.Testing.test_f_[-1] = open(read_source, 'r', encoding='utf-8')
+                    core.Testing.test_comparator_[-1] = testing_functions.TestComparator(read_source)
                 else:
                     core.Testing.testMessage(f"File '{read_source}' does not exist; stopping test.")
                     core.Testing.testStop(True)
-            if core.Testing.test_f_[-1] is not None:
-                line = re.sub('\n', '', line)
-                test_line = core.Testing.test_f_[-1].readline()
-                if test_line != '':
-                    test_line = re.sub('\n', '', test_line)
-                    if line == test_line:
-                        core.Testing.testMessage(f"Passed: {line}")
-                        core.Testing.test_pass_[-1] += 1
-                    else:
-                        core.Testing.testMessage(f"Expected: '{test_line}'", True)
-                        core.Testing.testMessage(f"Received: '{line}'", True)
-                        core.Testing.test_fail_[-1] += 1
-                else:
-                    core.Testing.testMessage('Unexpected EOF reached; stopping test.', True)
-                    core.Testing.testStop(True)
+            if core.Testing.test_comparator_[-1] is not None:
+                core.Testing.testCompare(line)
         except: # pylint: disable=bare-except
             core.Testing.testMessage(f"Unexpected error: {line}", True)
+            core.Main.writer.flush()
             traceback.print_exc()
-    if not core.Testing.testing_[-1]:
-        print(line, file=stdio)
+    if not testing.testing_[-1]:
+        core_session.current().writer.write(line, stdio)
+
+################################################################################
+# classify lines in a single pass
+#
+#    - Comments, blank lines and labels are recognized by their first
+#      non-blank character, so most lines are classified without a regex.
+#    - A line ending with */ closes a block comment no matter how it starts.
+################################################################################
+
+LINE_DATA = 0
+LINE_DIRECTIVE = 1
+LINE_COMMENT = 2
+LINE_BLANK = 3
+LINE_LABEL = 4
+LINE_BLOCK_OPEN = 5
+LINE_BLOCK_CLOSE = 6
+LINE_BLOCK = 7 # opens and closes a block comment on the same line
+
+def classify_line(line):
+    # return the line kind, along with the label name for LINE_LABEL
+
+    stripped = line.strip()
+    if stripped.endswith('*/'):
+        if stripped.startswith('/*'):
+            return LINE_BLOCK, None
+        return LINE_BLOCK_CLOSE, None
+    if stripped == '':
+        return LINE_BLANK, None
+    first = stripped[0]
+    if first == '#':
+        return LINE_COMMENT, None
+    if first == '/':
+        if stripped.startswith('/*'):
+            return LINE_BLOCK_OPEN, None
+        if stripped.startswith('//'):
+            return LINE_COMMENT, None
+    elif first == '-':
+        if stripped.replace('-', '').strip() == '':
+            return LINE_BLANK, None
+    if stripped.endswith(':'):
+        label = stripped[:-1]
+        if label == '' or label.split() == [label]:
+            return LINE_LABEL, label
+    if first == '&':
+        return LINE_DIRECTIVE, None
+    return LINE_DATA, None
 
 ################################################################################
 # process comments and gotos
 ################################################################################
 
 def skip_line(line):
-    if core.Main.comment_mode_[-1] == -1:
-        core.Main.comment_mode_[-1] = 0
-    if re.search(r'^\s*\/\*', line):
-        core.Main.comment_mode_[-1] = 1
-    if re.search(r'\*\/\s*$', line):
-        core.Main.comment_mode_[-1] = -1
-    if core.Main.comment_mode_[-1] != 0:
-        return True
-    if re.search(r'^\s*\#', line):
-        return True
-    if re.search(r'^\s*\/\/', line):
+    main = core.Main.state()
+    comment_mode = main.comment_mode_
+    if comment_mode[-1] == -1:
+        comment_mode[-1] = 0
+    kind, label = classify_line(line)
+    if kind == LINE_BLOCK_OPEN:
+        comment_mode[-1] = 1
+    elif kind in (LINE_BLOCK_CLOSE, LINE_BLOCK):
+        comment_mode[-1] = -1
+    if comment_mode[-1] != 0:
         return True
-    if re.search(r'^[\s-]*$', line):
+    if kind in (LINE_COMMENT, LINE_BLANK):
         return True
-    m = re.search(r'^\s*(\S*)\:\s*$', line)
-    if m:
-        if m.group(1) == core.Main.goto_[-1]:
+    if kind == LINE_LABEL:
+        if label == core.Main.goto_[-1]:
             core.Main.goto_[-1] = None
-        elif m.group(1) == core.Main.until_:
+        elif label == core.Main.until_:
             core.Main.until_ = None
             keys = core.Main.until_var_key_.split(',')
             if not core.Main.until_quiet_:
@@ -371,9 +544,9 @@ def skip_line(line):
                     info_message(var_functions.show_var(key))
             unfreeze_history()
         return True
-    if core.Main.goto_[-1]:
+    if main.goto_[-1]:
         return True
-    if core.Main.until_:
+    if main.until_:
         var_functions.process_until(line)
         return True
     return False
@@ -424,6 +597,7 @@ def page_text(text):
 ################################################################################
 
 def show_help(topic, stop_running = False):
+    core.Main.writer.flush()
     helpfile = None
     if not topic:
         topic = 'usage'
@@ -462,6 +636,7 @@ def push_env():
         core.Main.read_path_,
         core.Main.elements_,
         core.Main.formats_,
+        core.Main.formatters_,
         core.Main.headers_,
         core.Main.justify_,
         core.Main.padding_,
@@ -475,7 +650,7 @@ def push_env():
     push_lists([
         core.Testing.testing_,
         core.Testing.test_filename_,
-        core.Testing.test_f_,
+        core.Testing.test_comparator_,
         core.Testing.test_pause_,
         core.Testing.test_verbose_,
         core.Testing.test_pass_,
@@ -493,6 +668,7 @@ def pop_env():
         core.Main.read_path_,
         core.Main.elements_,
         core.Main.formats_,
+        core.Main.formatters_,
         core.Main.headers_,
         core.Main.justify_,
         core.Main.padding_,
@@ -506,7 +682,7 @@ def pop_env():
     pop_lists([
         core.Testing.testing_,
         core.Testing.test_filename_,
-        core.Testing.test_f_,
+        core.Testing.test_comparator_,
         core.Testing.test_pause_,
         core.Testing.test_verbose_,
         core.Testing.test_pass_,
@@ -519,9 +695,8 @@ def push_lists(lists):
         for pushlist in lists:
             if pushlist is not None:
                 newlist = pushlist[-1]
-                if isinstance(newlist, dict):
-                    newdict = newlist.copy()
-                    pushlist.append(newdict)
+                if isinstance(newlist, (dict, LayeredDict)):
+                    pushlist.append(LayeredDict(newlist))
                 else:
                     pushlist.append(pushlist[-1])
 
@@ -535,7 +710,136 @@ def pop_lists(lists):
                     else:
                         copy = poplist[-1]
                         poplist.pop()
-                        poplist[-1] = copy
+                        if isinstance(copy, LayeredDict) and copy.parent is poplist[-1]:
+                            copy.merge_into_parent()
+                        else:
+                            poplist[-1] = copy
+
+################################################################################
+# copy-on-write dictionary layers for sandboxed environments
+#
+#    - Pushing an environment adds an empty layer instead of copying the dict.
+#    - The layer holds only its own writes; reads that miss it go to the
+#      parent and are not stored.
+#    - Deleted parent keys are tombstoned, so they stay hidden in this layer.
+#    - Iteration follows the order a copied dict would have had.
+#    - A layer is a MutableMapping rather than a dict subclass, so dict(),
+#      ** and every dict method go through the layer, not an empty dict.
+################################################################################
+
+MISSING = object()
+
+class LayeredDict(MutableMapping):
+    # dict layer that falls back to its parent for missing keys
+
+    __slots__ = ('parent', 'layer', 'tombstones', 'size')
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.layer = {}
+        self.tombstones = set()
+        self.size = len(parent)
+
+    def __getitem__(self, key):
+        value = self.layer.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        if key in self.tombstones:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __contains__(self, key):
+        if key in self.layer:
+            return True
+        return key not in self.tombstones and key in self.parent
+
+    def __setitem__(self, key, value):
+        layer = self.layer
+        if key not in layer and (key in self.tombstones or key not in self.parent):
+            self.size += 1
+        layer[key] = value
+
+    def __delitem__(self, key):
+        found = key in self.layer
+        if found:
+            del self.layer[key]
+        if key not in self.tombstones and key in self.parent:
+            # a tombstone also moves the key to the end if it is set again
+            self.tombstones.add(key)
+            found = True
+        if not found:
+            raise KeyError(key)
+        self.size -= 1
+
+    def __iter__(self):
+        parent = self.parent
+        tombstones = self.tombstones
+        for key in parent:
+            if key not in tombstones:
+                yield key
+        for key in self.layer:
+            if key in tombstones or key not in parent:
+                yield key
+
+    def __reversed__(self):
+        parent = self.parent
+        tombstones = self.tombstones
+        for key in reversed(self.layer):
+            if key in tombstones or key not in parent:
+                yield key
+        for key in reversed(parent):
+            if key not in tombstones:
+                yield key
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __or__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self) | dict(other)
+
+    def __ror__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(other) | dict(self)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __copy__(self):
+        layered = LayeredDict(self.parent)
+        layered.layer = self.layer.copy()
+        layered.tombstones = self.tombstones.copy()
+        layered.size = self.size
+        return layered
+
+    def clear(self):
+        self.layer.clear()
+        self.tombstones = set(self.parent)
+        self.size = 0
+
+    def popitem(self):
+        # last in, first out, as for a dict
+        for key in reversed(self):
+            value = self[key]
+            del self[key]
+            return key, value
+        raise KeyError('popitem(): dictionary is empty')
+
+    def copy(self):
+        return dict(self)
+
+    def merge_into_parent(self):
+        # inline reads keep their changes: apply this layer to the parent
+        parent = self.parent
+        for key in self.tombstones:
+            parent.pop(key, None)
+        parent.update(self.layer)
 
 ################################################################################
 # messaging
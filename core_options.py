@@ -18,6 +18,7 @@ import sys
 import core
 import bridge
 import core_functions
+import var_columns
 
 ################################################################################
 # process command-line options
@@ -52,6 +53,28 @@ def parse_options(argv = sys.argv):
                     core.Main.msg.error_message(f"Parameter expected: {option}")
                     core_functions.print_line()
                     core_functions.show_help('usage', True)
+            elif option in ['-cp', '--checkpoint', '-rf', '--resume-from']:
+                if i < len(argv) - 1:
+                    if option in ['-cp', '--checkpoint']:
+                        core.Cli.checkpoint_ = argv[i+1]
+                    else:
+                        core.Cli.resume_from_ = argv[i+1]
+                    skip = True
+                else:
+                    core.Main.msg.error_message(f"Parameter expected: {option}")
+                    core_functions.print_line()
+                    core_functions.show_help('usage', True)
+            elif option in ['-ob', '--output-buffer']:
+                buffer_size = None
+                if i < len(argv) - 1 and argv[i+1].isdigit():
+                    buffer_size = int(argv[i+1])
+                    skip = True
+                if buffer_size is not None:
+                    core.Main.writer.set_buffer_size(buffer_size)
+                else:
+                    core.Main.msg.error_message(f"Buffer size expected: {option}")
+                    core_functions.print_line()
+                    core_functions.show_help('usage', True)
             elif option in ['-vv']:
                 core.Cli.verbose_verbose_ = True
             elif option in ['-h', '---help']:
@@ -72,6 +95,8 @@ def parse_options(argv = sys.argv):
                 core.Main.parser().parse_directive('&test quiet')
             elif option in ['-dpm0', '--debug-print-mode-off']: # undocumented, for testing purposes
                 core.Testing.debug_print_mode = False
+            elif option in ['-np0', '--numpy-off']: # undocumented, for testing purposes
+                var_columns.NUMPY_IMPORTED = False
             else:
                 if i < len(argv) - 1:
                     parameter = argv[i+1]
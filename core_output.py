@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Core functions to handle buffered output
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import atexit
+import sys
+
+# default number of characters to hold before writing to stdout
+DEFAULT_BUFFER_SIZE = 65536
+
+################################################################################
+# buffered writer for stdout
+#
+#    - Lines bound for stdout are collected and written in batches.
+#    - Anything else (e.g., stderr) flushes stdout first, so messages stay in
+#      order when both streams go to the same terminal.
+#    - A buffer size of 0 writes every line immediately.
+################################################################################
+
+class OutputWriter():
+
+    def __init__(self, buffer_size = DEFAULT_BUFFER_SIZE, stream = None):
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+
+        # None follows sys.stdout, even when it is redirected later
+        self.stream = stream
+
+    def write(self, line = '', stdio = None):
+        if stdio is None or stdio is sys.stdout or stdio is self.stream:
+            line = str(line)
+            self.buffer.append(line)
+            self.buffered += len(line) + 1
+            if self.buffered > self.buffer_size:
+                self.flush()
+        else:
+            self.flush()
+            print(line, file=stdio)
+            stdio.flush()
+
+    def flush(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        if self.buffer:
+            self.buffer.append('')
+            stream.write('\n'.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        stream.flush()
+
+    def set_buffer_size(self, buffer_size):
+        self.buffer_size = buffer_size
+        if self.buffered > self.buffer_size:
+            self.flush()
+
+################################################################################
+# in-memory writer for rendering without the command line (see crunchy.render)
+#
+#    - Lines bound for stdout are kept as output rows until they are taken.
+#    - Anything else (e.g., error messages) is kept separately.
+################################################################################
+
+class RowCollector():
+
+    def __init__(self):
+        self.rows = []
+        self.errors = []
+
+    def write(self, line = '', stdio = None):
+        if stdio is None or stdio is sys.stdout:
+            self.rows.append(str(line))
+        else:
+            self.errors.append(str(line))
+
+    def take(self):
+        rows = self.rows
+        self.rows = []
+        return rows
+
+    def flush(self):
+        pass # rows are taken, not flushed
+
+    def set_buffer_size(self, buffer_size):
+        pass # rows are never written
+
+writer = OutputWriter()
+
+# write whatever is left when the interpreter exits
+atexit.register(writer.flush)
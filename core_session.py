@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Sessions that own all environment state
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import contextlib
+import contextvars
+import copy
+import threading
+
+import core_output
+
+################################################################################
+# session state
+#
+#    - A Session owns one state object for each class decorated with
+#      session_state (core.Main, core.Testing, core.Cli, bridge.Plugin, and
+#      the plugin My classes), plus its own output writer.
+#    - State objects are created on first use from the class defaults.
+#    - Each thread starts with its own session; use activate() to run
+#      another session in the current thread.
+#    - The current session is held in a context variable, which is much
+#      cheaper to read than a threading.local.
+################################################################################
+
+class StateTable(dict):
+    __slots__ = ()
+
+    def __missing__(self, facade):
+        state = facade.new_state()
+        self[facade] = state
+        return state
+
+class Session():
+    __slots__ = ('states', 'writer')
+
+    def __init__(self, writer = None):
+        self.states = StateTable()
+        self.writer = writer if writer is not None else core_output.OutputWriter()
+
+    def state(self, facade):
+        return self.states[facade]
+
+    @contextlib.contextmanager
+    def activate(self):
+        token = current_.set(self)
+        try:
+            yield self
+        finally:
+            current_.reset(token)
+
+current_ = contextvars.ContextVar('crunchy_session')
+get_current = current_.get
+
+def new_current():
+    # the main thread keeps the module writer, which is flushed at exit
+    if threading.current_thread() is threading.main_thread():
+        session = Session(core_output.writer)
+    else:
+        session = Session()
+    current_.set(session)
+    return session
+
+def current():
+    try:
+        return get_current()
+    except LookupError:
+        return new_current()
+
+################################################################################
+# class facades
+#
+#    - Decorating a class replaces it with an instance of a facade class that
+#      forwards each state attribute to the current session.
+#    - State attributes are those ending in '_', plus any listed in extra and
+#      minus any listed in shared; everything else stays on the facade and is
+#      shared by all sessions.
+#    - Functions stay plain functions (not bound methods) on the facade.
+#    - Hot paths can bind the state object once with facade.state().
+################################################################################
+
+class Facade():
+
+    def state(self):
+        try:
+            return get_current().states[self]
+        except LookupError:
+            return new_current().states[self]
+
+    def new_state(self):
+        state = self.state_class()
+        for name, value in self.defaults.items():
+            setattr(state, name, copy.deepcopy(value))
+        return state
+
+def state_property(name):
+    def fget(facade):
+        try:
+            return getattr(get_current().states[facade], name)
+        except LookupError:
+            return getattr(new_current().states[facade], name)
+    def fset(facade, value):
+        setattr(current().states[facade], name, value)
+    return property(fget, fset)
+
+def session_state(extra = (), shared = ()):
+    def decorate(cls):
+        namespace = {}
+        defaults = {}
+        for name, value in vars(cls).items():
+            if name in ('__dict__', '__weakref__'):
+                continue
+            if name not in shared and (name in extra or (name.endswith('_') and not name.startswith('__'))):
+                defaults[name] = value
+                namespace[name] = state_property(name)
+            elif callable(value) and not isinstance(value, type):
+                namespace[name] = staticmethod(value)
+            else:
+                namespace[name] = value
+        facade = type(cls.__name__, (Facade,), namespace)()
+        facade.__name__ = cls.__name__
+        facade.__qualname__ = cls.__qualname__
+        facade.defaults = defaults
+        facade.state_class = type(f"{cls.__name__}State", (), {'__slots__': tuple(defaults)})
+        return facade
+    return decorate
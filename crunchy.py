@@ -14,14 +14,17 @@
 ################################################################################
 
 import fileinput
-import re
+import sys
 import traceback
 
 # for interactive up/down arrow history
 import readline # pylint: disable=unused-import
 
 import core
+import core_checkpoint
 import core_functions
+import core_output
+import core_session
 import var_functions
 
 # abstraction layer for plugins
@@ -33,13 +36,15 @@ core.Main.version_ = 'v0.0.38'
 # send data to the plugin for processing
 ################################################################################
 
-def process_data(cli_filenames): # pylint: disable=too-many-branches
+def process_data(cli_filenames):
     should_stop = True
+    line = None
     try:
         if core.Main.interactive_:
             prompt = core.Main.interactive_prompt_
             if core.Main.goto_[-1] is not None or core.Main.until_ is not None:
                 prompt = core.Main.interactive_prompt_focused_
+            core.Main.writer.flush()
             line = input(prompt)
             if not core_functions.skip_line(line):
                 line = var_functions.parse_references(line)
@@ -48,62 +53,169 @@ def process_data(cli_filenames): # pylint: disable=too-many-branches
             should_stop = False
         else:
             with fileinput.FileInput(files=(cli_filenames), mode='r') as lines:
-                for line in lines:
-                    line = re.sub('\n', '', line)
+                for line in core_checkpoint.input_lines(lines):
+                    line = line.rstrip('\n')
                     if not core_functions.skip_line(line):
                         line = var_functions.parse_references(line)
                         bridge.Plugin.parse_line(line)
                     var_functions.process_release()
                     if not core.Main.running_[-1]:
                         break
-    except EOFError:
-        print()
-        should_stop = True
-    except FileNotFoundError as e:
-        core.Main.msg.error_message(f"Input file not found: {e.filename}")
-    except IndexError:
-        core.Main.msg.error_message(f"Badly formed data: {line}")
-        should_stop = False
-        if core.Cli.verbose_verbose_:
-            traceback.print_exc()
-    except ValueError:
-        core.Main.msg.error_message(f"Invalid input: {line}")
-        should_stop = False
-        if core.Cli.verbose_verbose_:
-            traceback.print_exc()
-    except KeyboardInterrupt:
-        core.Main.msg.error_message('Interrupted.')
-    except: # pylint: disable=bare-except
-        core.Main.msg.error_message('Unexpected error.')
-        traceback.print_exc()
+    except BaseException as e: # pylint: disable=broad-exception-caught
+        should_stop = report_exception(e, line)
     finally:
         if core.Testing.testing_[-1]:
             core.Testing.testStop()
     if should_stop:
         core.Main.running_[-1] = False
 
-####################
-# start here
-####################
+# report an exception raised while processing a line; returns whether to stop
+def report_exception(e, line):
+    if isinstance(e, EOFError):
+        core.Main.writer.write()
+        return True
+    if isinstance(e, FileNotFoundError):
+        core.Main.msg.error_message(f"Input file not found: {e.filename}")
+        return True
+    if isinstance(e, (IndexError, ValueError)):
+        if isinstance(e, IndexError):
+            core.Main.msg.error_message(f"Badly formed data: {line}")
+        else:
+            core.Main.msg.error_message(f"Invalid input: {line}")
+        if core.Cli.verbose_verbose_:
+            traceback.print_exc()
+        return False
+    if isinstance(e, KeyboardInterrupt):
+        core.Main.msg.error_message('Interrupted.')
+        return True
+    core.Main.msg.error_message('Unexpected error.')
+    traceback.print_exc()
+    return True
 
-# initialize all environments
-core.reset()
-core.Testing.reset()
-bridge.use_plugin('shell')
+################################################################################
+# render a report from lines of input, without the command line
+#
+#    - Lines can come from any iterable of strings or an open file; a single
+#      string is split into lines.
+#    - Iterating over the report yields output rows as they are produced.
+#    - Once iteration finishes, report.results holds the final values, such
+#      as test counts and whatever the plugin reports (e.g., balances).
+#    - Each report runs in its own session (see core_session), so reports can
+#      be rendered side by side, including from several threads.
+################################################################################
 
-# process command-line options
-filenames = core.Main.parser.parse_options()
+class Report():
 
-# show information when starting in interactive mode
-core.Main.interactive_ = core_functions.check_interactivity(filenames)
-core_functions.show_info()
+    def __init__(self, lines, plugin = None, options = None):
+        if isinstance(lines, str):
+            lines = lines.splitlines()
+        self.lines = lines
+        self.plugin = plugin
+        self.options = list(options) if options is not None else []
+        self.collector = core_output.RowCollector()
+        self.session = core_session.Session(self.collector)
+        self.results = None
 
-# main parsing loop
-while core.Main.running_[-1]:
-    process_data(filenames)
-    if not core.Main.interactive_:
-        break
+    def __iter__(self):
+        with self.session.activate():
+            # the plugin goes first, as with -up on the command line, so it
+            # sees its own options
+            plugin = ['-up', self.plugin] if self.plugin is not None else []
+            start(['crunchy.py'] + plugin + self.options)
+            lines = core_checkpoint.input_lines(self.lines)
+        yield from self.collector.take()
+
+        line = None
+        for line in lines:
+            with self.session.activate():
+                running = self.process_line(line)
+            yield from self.collector.take()
+            if not running:
+                break
+
+        with self.session.activate():
+            if core.Testing.testing_[-1]:
+                core.Testing.testStop()
+            finish()
+            self.results = self.get_results()
+        yield from self.collector.take()
+        return self.results
+
+    @staticmethod
+    def process_line(line):
+        try:
+            line = line.rstrip('\n')
+            if not core_functions.skip_line(line):
+                line = var_functions.parse_references(line)
+                bridge.Plugin.parse_line(line)
+            var_functions.process_release()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            report_exception(e, line)
+            core.Main.running_[-1] = False
+        return core.Main.running_[-1]
+
+    def get_results(self):
+        tests = list(core.Testing.results_)
+        return {
+            'plugin': bridge.Plugin.identify(),
+            'tests': {
+                'passed': sum(test[1] for test in tests),
+                'failed': sum(test[2] for test in tests),
+                'files': tests,
+            },
+            'variables': {key: list(value) for key, value in core.Main.variables_[-1].items()},
+            'errors': list(self.collector.errors),
+            **bridge.Plugin.get_results(),
+        }
+
+def render(lines, plugin = None, options = None):
+    return Report(lines, plugin, options)
+
+################################################################################
+# run crunchy with the given command-line arguments
+################################################################################
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv
+
+    filenames = start(argv)
+
+    # show information when starting in interactive mode
+    core.Main.interactive_ = core_functions.check_interactivity(filenames)
+    core_functions.show_info()
+
+    # main parsing loop
+    while core.Main.running_[-1]:
+        process_data(filenames)
+        if not core.Main.interactive_:
+            break
+
+    finish()
+
+def start(argv):
+    # initialize all environments
+    core.reset()
+    core.Testing.reset()
+    bridge.use_plugin('shell')
+
+    # process command-line options
+    return core.Main.parser.parse_options(argv)
+
+def finish():
+    # gracefully handle uncompleted goto directives
+    if core.Main.goto_[-1]:
+        core.Main.msg.error_message(f"EOF reached before tag '{core.Main.goto_[-1]}")
+
+    # write a checkpoint for --checkpoint
+    core_checkpoint.save()
+
+    # write any buffered output
+    core.Main.writer.flush()
+
+####################
+# start here
+####################
 
-# gracefully handle uncompleted goto directives
-if core.Main.goto_[-1]:
-    core.Main.msg.error_message(f"EOF reached before tag '{core.Main.goto_[-1]}")
+if __name__ == '__main__':
+    main()
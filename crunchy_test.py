@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Regression test runner
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+# plugins are imported relative to this directory, even after chdir
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import core # pylint: disable=wrong-import-position
+import crunchy # pylint: disable=wrong-import-position
+
+################################################################################
+# find test input files
+#
+#    - Any file with a line starting with &test start is a test input file.
+#    - Directories are searched recursively.
+################################################################################
+
+def is_test_file(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.lstrip().startswith('&test start'):
+                    return True
+    except (OSError, UnicodeDecodeError):
+        pass
+    return False
+
+def discover(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    filename = os.path.join(root, name)
+                    if is_test_file(filename):
+                        found.append(filename)
+        elif os.path.isfile(path):
+            found.append(path)
+        else:
+            print(core.ANSI.FG_RED + f"<E> Test input not found: {path}" + core.ANSI.FG_DEFAULT, file=sys.stderr)
+    return found
+
+################################################################################
+# run a single test input file
+#
+#    - Each file runs in its own worker process, so the class-level state in
+#      core is never shared between tests.
+#    - Relative &test and &read paths resolve from the file's directory.
+################################################################################
+
+def run_test(filename, options):
+    start = time.perf_counter()
+    output = io.StringIO()
+    crashed = False
+    os.chdir(os.path.dirname(os.path.abspath(filename)))
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            crunchy.main(['crunchy.py'] + options + [os.path.basename(filename)])
+        except SystemExit:
+            core.Main.writer.flush()
+        except: # pylint: disable=bare-except
+            crashed = True
+            core.Main.writer.flush()
+            traceback.print_exc()
+    elapsed = time.perf_counter() - start
+    return filename, list(core.Testing.results_), crashed, elapsed, output.getvalue()
+
+def run_test_args(args):
+    return run_test(*args)
+
+################################################################################
+# summarize the results
+################################################################################
+
+def report(result, show_output):
+    filename, results, crashed, elapsed, output = result
+    passed = sum(r[1] for r in results)
+    failed = sum(r[2] for r in results)
+    ok = bool(results) and failed == 0 and not crashed
+    if ok:
+        status = core.ANSI.FG_GREEN + 'PASS' + core.ANSI.FG_DEFAULT
+    elif crashed:
+        status = core.ANSI.FG_RED + 'CRASH' + core.ANSI.FG_DEFAULT
+    elif not results:
+        status = core.ANSI.FG_RED + 'NO TEST' + core.ANSI.FG_DEFAULT
+    else:
+        status = core.ANSI.FG_RED + 'FAIL' + core.ANSI.FG_DEFAULT
+    print(f"{status:>16} {elapsed:8.3f}s {passed:7} passed {failed:7} failed  {filename}")
+    if show_output or (not ok and show_output is None):
+        for line in output.splitlines():
+            print('      ' + line)
+    return ok, passed, failed
+
+def show_usage():
+    print('Usage: crunchy_test.py [options] [<file or directory> ...]')
+    print()
+    print('   -j | --jobs <count>   Number of worker processes (default: one per CPU).')
+    print('   -o | --output         Show the output of every test, not just failing ones.')
+    print('   -q | --quiet          Never show test output.')
+    print('   --                    Pass the remaining options to crunchy.py.')
+
+################################################################################
+# start here
+################################################################################
+
+def main(argv = None): # pylint: disable=too-many-branches
+    if argv is None:
+        argv = sys.argv
+    jobs = os.cpu_count() or 1
+    show_output = None
+    paths = []
+    options = []
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in ['-j', '--jobs']:
+            count = next(args, '')
+            if not count.isdigit() or int(count) < 1:
+                print(f"Job count expected: {arg} {count}".rstrip(), file=sys.stderr)
+                show_usage()
+                return 2
+            jobs = int(count)
+        elif arg in ['-o', '--output']:
+            show_output = True
+        elif arg in ['-q', '--quiet']:
+            show_output = False
+        elif arg in ['-h', '--help']:
+            show_usage()
+            return 0
+        elif arg == '--':
+            options = list(args)
+        elif arg.startswith('-'):
+            print(f"Unknown option: {arg}", file=sys.stderr)
+            show_usage()
+            return 2
+        else:
+            paths.append(arg)
+
+    filenames = discover(paths or ['.'])
+    if not filenames:
+        print('No test input files found.', file=sys.stderr)
+        return 1
+
+    # a fresh process for every test keeps the global state isolated
+    start = time.perf_counter()
+    total_passed = total_failed = bad_files = 0
+    work = [(filename, options) for filename in filenames]
+    with multiprocessing.Pool(min(jobs, len(work)), maxtasksperchild=1) as pool:
+        for result in pool.imap(run_test_args, work):
+            ok, passed, failed = report(result, show_output)
+            total_passed += passed
+            total_failed += failed
+            bad_files += 0 if ok else 1
+    elapsed = time.perf_counter() - start
+
+    s = 's' if len(filenames) != 1 else ''
+    color = core.ANSI.FG_GREEN if bad_files == 0 else core.ANSI.FG_RED
+    print(color + f"{len(filenames)} file{s} in {elapsed:.3f}s: "
+          f"{total_passed} lines passed, {total_failed} lines failed, {bad_files} file{'s' if bad_files != 1 else ''} not passing"
+          + core.ANSI.FG_DEFAULT)
+    return 0 if bad_files == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,14 +13,19 @@
 # See the LICENSE file in the project root for more information.
 ################################################################################
 
+import functools
 import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
 
 import core
+import core_directives
+import core_session
 from core_functions import format_element_by_value, ljustify, rjustify, currency, pre_parse, print_line
 
 def identify():
     return 'banking'
 
+@core_session.session_state()
 class My():
     fulbal_ = []
     clrbal_ = []
@@ -28,23 +33,27 @@ class My():
     clrfield_ = []
     incfield_ = []
     decfield_ = []
-    catvalues_ = []
-    statvalues_ = []
+    datefield_ = []
+    categories_ = []
+    periods_ = []
+    init_ = []
 
 def reset():
-    My.fulbal_ = [0.0]
-    My.clrbal_ = [0.0]
+    My.fulbal_ = [money().zero]
+    My.clrbal_ = [money().zero]
     My.catfield_ = [None]
     My.clrfield_ = [None]
     My.incfield_ = [None]
     My.decfield_ = [None]
-    My.catvalues_ = [{}]
-    My.statvalues_ = [{}]
+    My.datefield_ = [None]
+    My.categories_ = [{}]
+    My.periods_ = [{}]
+    My.init_ = [None]
 
+@core_session.session_state(extra = ['override_init', 'money_mode'])
 class Cli():
     override_init = False
-
-reset()
+    money_mode = 'float'
 
 def get_env():
     return [
@@ -54,14 +63,270 @@ def get_env():
         My.clrfield_,
         My.incfield_,
         My.decfield_,
-        My.catvalues_,
-        My.statvalues_
+        My.datefield_,
+        My.categories_,
+        My.periods_,
+        My.init_
     ]
 
+# final values for crunchy.render
+def get_results():
+    value = money().value
+    categories = {}
+    stats = {} if My.init_[-1] is None else {'init': value(My.init_[-1])}
+    for category, category_stats in My.categories_[-1].items():
+        categories[category + 'payamt'] = value(category_stats.payamt)
+        categories[category + 'depamt'] = value(category_stats.depamt)
+        for name in STATS_NAMES:
+            stats[category + name] = value(getattr(category_stats, STATS_NAMES[name]))
+    periods = {}
+    for (by, period, category), (payamt, depamt) in My.periods_[-1].items():
+        totals = {'payamt': value(payamt), 'depamt': value(depamt)}
+        periods.setdefault(by, {}).setdefault(period, {})[category] = totals
+    return {
+        'balance': value(My.fulbal_[-1]),
+        'cleared': value(My.clrbal_[-1]),
+        'categories': categories,
+        'stats': stats,
+        'periods': periods
+    }
+
 # min-max boundaries for stats
 STATS_MIN = 0.0
 STATS_MAX = 9999999.0
 
+################################################################################
+# category stats
+#
+#    - My.categories_ maps each category to a CategoryStats record, with all
+#      entries under ''.
+#    - Records are copied into a sandbox layer before changing them, since a
+#      LayeredDict shares its parent's values.
+#    - get_results flattens the records into the original key names.
+################################################################################
+
+STATS_NAMES = {
+    'min-in': 'min_in', 'max-in': 'max_in', 'num-in': 'num_in', 'sum-in': 'sum_in',
+    'min-out': 'min_out', 'max-out': 'max_out', 'num-out': 'num_out', 'sum-out': 'sum_out'
+}
+
+class CategoryStats():
+    # running totals and min/max/count/sum stats of one category
+
+    __slots__ = ('owner', 'payamt', 'depamt', 'min_in', 'max_in', 'num_in', 'sum_in', 'min_out', 'max_out', 'num_out', 'sum_out')
+
+    def __init__(self, owner, mode):
+        self.owner = owner
+        self.payamt = mode.zero
+        self.depamt = mode.zero
+        self.min_in = mode.stats_max
+        self.max_in = mode.stats_min
+        self.num_in = 0
+        self.sum_in = 0
+        self.min_out = mode.stats_max
+        self.max_out = mode.stats_min
+        self.num_out = 0
+        self.sum_out = 0
+
+    def copy(self, owner):
+        copy = CategoryStats.__new__(CategoryStats)
+        copy.owner = owner
+        for name in self.__slots__[1:]:
+            setattr(copy, name, getattr(self, name))
+        return copy
+
+    def add(self, payamt, depamt):
+        self.payamt += payamt
+        self.depamt += depamt
+        if depamt < self.min_in and payamt == 0.0:
+            self.min_in = depamt
+        if depamt > self.max_in:
+            self.max_in = depamt
+        if depamt > 0:
+            self.num_in += 1
+            self.sum_in += depamt
+        if payamt < self.min_out and depamt == 0.0:
+            self.min_out = payamt
+        if payamt > self.max_out:
+            self.max_out = payamt
+        if payamt > 0:
+            self.num_out += 1
+            self.sum_out += payamt
+
+def add_category_stats(categories, category, payamt, depamt):
+    category_stats = categories[category] if category in categories else None
+    if category_stats is None:
+        category_stats = categories[category] = CategoryStats(categories, money())
+    elif category_stats.owner is not categories:
+        category_stats = categories[category] = category_stats.copy(categories)
+    category_stats.add(payamt, depamt)
+
+################################################################################
+# period stats for &stats --by
+#
+#    - With a date field, each entry is also added to the (payamt, depamt)
+#      totals of its day, month and year, in My.periods_ under (<by>,
+#      <period>, <category>) keys, so &stats --by needs no second pass over
+#      the data.  The totals are tuples, so a sandbox layer never changes
+#      its parent's values.
+#    - Dates are parsed by core.Main.DateUtil, and the periods of each date
+#      are cached.
+#    - Entries with dates that cannot be parsed go to an 'unknown' period, so
+#      the periods add up to the overall totals.
+################################################################################
+
+PERIODS = ('day', 'month', 'year')
+UNKNOWN_PERIODS = tuple((by, 'unknown') for by in PERIODS)
+
+def row_periods(datestr):
+    # (<by>, <period>) pairs for a date, e.g. ('month', '2023-11')
+    try:
+        date = core.Main.DateUtil.parse(datestr)
+    except (ValueError, OverflowError):
+        return UNKNOWN_PERIODS
+    return date_periods(date)
+
+@functools.lru_cache(maxsize=4096)
+def date_periods(date):
+    year = f"{date.year:04d}"
+    month = f"{year}-{date.month:02d}"
+    return (('day', f"{month}-{date.day:02d}"), ('month', month), ('year', year))
+
+def add_period_stats(periods, dates, categories, payamt, depamt):
+    zero = money().zero
+    for by, period in dates:
+        for category in ('', *categories):
+            key = (by, period, category)
+            period_payamt, period_depamt = periods[key] if key in periods else (zero, zero)
+            periods[key] = (period_payamt + payamt, period_depamt + depamt)
+
+################################################################################
+# money modes for --money-mode
+#
+#    - float (default) adds up amounts as floats.
+#    - cents adds up integer cents; amounts with two decimal places are parsed
+#      without float() or Decimal, others are rounded half to even to cents.
+#    - decimal adds up Decimal amounts, with any number of decimal places.
+#    - cents and decimal also accept thousands separators (e.g., 1,500.00).
+#    - Balances and stats are kept in the units of the mode, and converted to
+#      floats by MoneyMode.value for display and get_results.
+################################################################################
+
+THOUSANDS_RE = re.compile(r'[-+]?[0-9]{1,3}(?:,[0-9]{3})+(?:\.[0-9]*)?')
+CENT = Decimal('0.01')
+
+def without_thousands(text):
+    if ',' in text and THOUSANDS_RE.fullmatch(text) is not None:
+        return text.replace(',', '')
+    return text
+
+def to_cents(amount):
+    # integer cents of an amount, e.g. 201312 for 2,013.12
+    whole, _, part = amount.partition('.')
+    digits = whole + part
+    if len(part) == 2 and digits.isdecimal():
+        return int(digits)
+    return rounded_cents(amount)
+
+def rounded_cents(amount):
+    # to_cents for signs, thousands separators, spaces and other numbers of
+    # decimal places, rounded half to even (e.g., 3.335 is 334 cents)
+    try:
+        return int(to_decimal(amount).quantize(CENT, rounding=ROUND_HALF_EVEN) * 100)
+    except InvalidOperation as e:
+        raise ValueError(f"Invalid amount: {amount}") from e
+
+def to_decimal(amount):
+    # exact Decimal of an amount
+    try:
+        value = Decimal(without_thousands(amount.strip()))
+    except InvalidOperation as e:
+        raise ValueError(f"Invalid amount: {amount}") from e
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount}")
+    return value
+
+class MoneyMode():
+    # how amounts are converted, added up and displayed
+
+    def __init__(self, convert, zero, stats_min, stats_max, value):
+        self.convert = convert
+        self.zero = zero
+        self.stats_min = stats_min
+        self.stats_max = stats_max
+        self.value = value
+
+MONEY_MODES = {
+    'float': MoneyMode(float, 0.0, STATS_MIN, STATS_MAX, lambda amount: amount),
+    'cents': MoneyMode(to_cents, 0, round(STATS_MIN * 100), round(STATS_MAX * 100), lambda amount: amount / 100),
+    'decimal': MoneyMode(to_decimal, Decimal(0), Decimal(STATS_MIN), Decimal(STATS_MAX), lambda amount: float(Decimal(amount).quantize(CENT)))
+}
+
+def money():
+    return MONEY_MODES[Cli.money_mode]
+
+def set_money_mode(mode):
+    # convert the balances set so far (e.g., by --override-init)
+    value = money().value
+    convert = MONEY_MODES[mode].convert
+    for values in (My.fulbal_, My.clrbal_, My.init_):
+        for i, amount in enumerate(values):
+            if amount is not None:
+                values[i] = convert(repr(value(amount)))
+    Cli.money_mode = mode
+    My.categories_ = [{}]
+    My.periods_ = [{}]
+
+reset()
+
+################################################################################
+# running totals for --checkpoint and --resume-from (see core_checkpoint)
+#
+#    - A checkpoint holds the balances, the &init value, the category stats
+#      and the period totals, in the units of the money mode (Decimal amounts as
+#      strings, so they round-trip exactly).
+#    - Resuming switches to the money mode of the checkpoint.
+################################################################################
+
+def save_amount(amount):
+    return str(amount) if isinstance(amount, Decimal) else amount
+
+def load_amount(amount):
+    return Decimal(amount) if isinstance(amount, str) else amount
+
+def load_category_stats(owner, values):
+    category_stats = CategoryStats.__new__(CategoryStats)
+    category_stats.owner = owner
+    for name, value in zip(CategoryStats.__slots__[1:], values):
+        setattr(category_stats, name, load_amount(value))
+    return category_stats
+
+def get_checkpoint():
+    def saved(category_stats):
+        return [save_amount(getattr(category_stats, name)) for name in CategoryStats.__slots__[1:]]
+    return {
+        'money_mode': Cli.money_mode,
+        'balance': save_amount(My.fulbal_[-1]),
+        'cleared': save_amount(My.clrbal_[-1]),
+        'init': save_amount(My.init_[-1]),
+        'categories': [[category, saved(category_stats)] for category, category_stats in My.categories_[-1].items()],
+        'periods': [[*key, save_amount(payamt), save_amount(depamt)] for key, (payamt, depamt) in My.periods_[-1].items()]
+    }
+
+def set_checkpoint(totals):
+    if totals['money_mode'] != Cli.money_mode:
+        set_money_mode(totals['money_mode'])
+        core.Main.msg.info_message(f"Using the {Cli.money_mode} money mode of the checkpoint.")
+    My.fulbal_[-1] = load_amount(totals['balance'])
+    My.clrbal_[-1] = load_amount(totals['cleared'])
+    My.init_[-1] = load_amount(totals['init'])
+    categories = My.categories_[-1] = {}
+    for category, values in totals['categories']:
+        categories[category] = load_category_stats(categories, values)
+    periods = My.periods_[-1] = {}
+    for by, period, category, payamt, depamt in totals['periods']:
+        periods[(by, period, category)] = (load_amount(payamt), load_amount(depamt))
+
 ################################################################################
 # parse plugin-specific directives, but pre-parse for core directives first
 ################################################################################
@@ -71,92 +336,104 @@ def parse_my_directive(line):
     p.pre_parse_directive(line)
     if p.done:
         return
+    p.dispatch(DIRECTIVES)
+
+DIRECTIVES = core_directives.DirectiveRegistry()
+
+####################
+
+@DIRECTIVES.register('init')
+def directive_init(p):
+    argtrim = p.argtrim
+    if argtrim:
+        if not Cli.override_init:
+            My.fulbal_[-1] = money().convert(argtrim)
+            My.clrbal_[-1] = My.fulbal_[-1]
+            My.init_[-1] = My.fulbal_[-1]
+            core.Main.msg.info_message(f"Initializing balance to {currency(money().value(My.fulbal_[-1]))}.")
+        else:
+            core.Main.msg.info_message('Overriding &init directive.')
+    else:
+        p.invalid_usage('&init <float>')
+
+####################
+
+@DIRECTIVES.register('stats')
+def directive_stats(p):
     argtrim = p.argtrim
-    cmd = p.cmd
-    options = p.options
-
-    ####################
-
-    if cmd == 'init':
-        if argtrim:
-            if not Cli.override_init:
-                My.fulbal_[-1] = float(argtrim)
-                My.clrbal_[-1] = My.fulbal_[-1]
-                My.statvalues_[-1]['init'] = My.fulbal_[-1]
-                core.Main.msg.info_message(f"Initializing balance to {currency(My.fulbal_[-1])}.")
-            else:
-                core.Main.msg.info_message('Overriding &init directive.')
+    init = False
+    simple = True
+    by = False
+    for option in p.options:
+        if option in ['-f', '--full']:
+            simple = False
+        elif option in ['-i', '--init']:
+            init = True
+        elif option in ['-b', '--by']:
+            by = True
         else:
-            p.invalid_usage('&init <float>')
-
-    ####################
-
-    elif cmd == 'set':
-        show_usage = False
-        if argtrim:
-            parts = argtrim.split()
-            if len(parts) > 1:
-                if parts[0] == 'catfield':
-                    My.catfield_[-1] = int(parts[1])
-                    core.Main.msg.info_message(f"Setting category field to {str(My.catfield_[-1])}.")
-                elif parts[0] == 'clrfield':
-                    My.clrfield_[-1] = int(parts[1])
-                    core.Main.msg.info_message(f"Setting clear field to {str(My.clrfield_[-1])}.")
-                elif parts[0] == 'decfield':
-                    My.decfield_[-1] = int(parts[1])
-                    core.Main.msg.info_message(f"Setting decrement field to {str(My.decfield_[-1])}.")
-                elif parts[0] == 'incfield':
-                    My.incfield_[-1] = int(parts[1])
-                    core.Main.msg.info_message(f"Setting increment field to {str(My.incfield_[-1])}.")
-                else:
-                    show_usage = True
-            else:
-                show_usage = True
+            core.Main.parser.unrecognized_option(option)
+    if init:
+        My.categories_ = [{}]
+        My.periods_ = [{}]
+        My.init_ = [None]
+        core.Main.msg.info_message('Stats initialized.')
+    elif by:
+        words = argtrim.split() if argtrim else []
+        if not words or words[0] not in PERIODS:
+            p.invalid_usage('&stats --by day|month|year [<categories>]')
         else:
-            show_usage = True
-        if show_usage:
-            p.invalid_usage('&set [ catfield <int> | clrfield <int> | decfield <int> | incfield <int> ]')
-
-    ####################
-
-    elif cmd == 'stats':
-        init = False
-        simple = True
-        for option in options:
-            if option in ['-f', '--full']:
-                simple = False
-            elif option in ['-i', '--init']:
-                init = True
-            else:
-                core.Main.parser.unrecognized_option(option)
-        if init:
-            My.catvalues_ = [{}]
-            My.statvalues_ = [{}]
-            core.Main.msg.info_message('Stats initialized.')
-        elif simple:
-            if not argtrim:
-                simple_stats('All')
-            elif not ' ' in argtrim:
-                simple_stats(argtrim)
-            else:
-                simple_stats_header()
-                for category in argtrim.split():
-                    simple_stats(category, True)
-                if core.Main.output_[-1]:
-                    print_line()
+            period_stats(words[0], words[1:] or ['All'])
+    elif simple:
+        if not argtrim:
+            simple_stats('All')
+        elif not ' ' in argtrim:
+            simple_stats(argtrim)
         else:
-            if not argtrim:
-                more_stats('All')
-            elif not ' ' in argtrim:
-                more_stats(argtrim)
-            else:
-                for category in argtrim.split():
-                    more_stats(category)
+            simple_stats_header()
+            for category in argtrim.split():
+                simple_stats(category, True)
+            if core.Main.output_[-1]:
+                print_line()
+    else:
+        if not argtrim:
+            more_stats('All')
+        elif not ' ' in argtrim:
+            more_stats(argtrim)
+        else:
+            for category in argtrim.split():
+                more_stats(category)
+
+################################################################################
+# plugin-specific settings for the &set directive
+################################################################################
 
-    ####################
+SETTINGS = core_directives.SettingRegistry()
 
-    else:
-        p.invalid_directive()
+@SETTINGS.register('catfield', int, '<int>')
+def setting_catfield(value):
+    My.catfield_[-1] = value
+    core.Main.msg.info_message(f"Setting category field to {str(My.catfield_[-1])}.")
+
+@SETTINGS.register('clrfield', int, '<int>')
+def setting_clrfield(value):
+    My.clrfield_[-1] = value
+    core.Main.msg.info_message(f"Setting clear field to {str(My.clrfield_[-1])}.")
+
+@SETTINGS.register('datefield', int, '<int>')
+def setting_datefield(value):
+    My.datefield_[-1] = value
+    core.Main.msg.info_message(f"Setting date field to {str(My.datefield_[-1])}.")
+
+@SETTINGS.register('decfield', int, '<int>')
+def setting_decfield(value):
+    My.decfield_[-1] = value
+    core.Main.msg.info_message(f"Setting decrement field to {str(My.decfield_[-1])}.")
+
+@SETTINGS.register('incfield', int, '<int>')
+def setting_incfield(value):
+    My.incfield_[-1] = value
+    core.Main.msg.info_message(f"Setting increment field to {str(My.incfield_[-1])}.")
 
 ################################################################################
 # display banking stats in simple and complex formats
@@ -178,18 +455,14 @@ def simple_stats_header():
 
 def simple_stats(category, use_header = False):
     if check_cat_field():
-        catpay_key = category + 'payamt'
-        catdep_key = category + 'depamt'
-        if not catpay_key in My.catvalues_[-1] or not catdep_key in My.catvalues_[-1]:
-            catpay_key = 'payamt'
-            catdep_key = 'depamt'
+        category_stats = get_category_stats(category)
         cat_header_width = core.Main.width_[-1][My.catfield_[-1]]
         dec_header = core.Main.headers_[-1][My.decfield_[-1]]
         dec_header_width = core.Main.width_[-1][My.decfield_[-1]]
-        catpay_currency = currency(My.catvalues_[-1][catpay_key])
+        catpay_currency = currency(money().value(category_stats.payamt))
         inc_header = core.Main.headers_[-1][My.incfield_[-1]]
         inc_header_width = core.Main.width_[-1][My.incfield_[-1]]
-        catdep_currency = currency(My.catvalues_[-1][catdep_key])
+        catdep_currency = currency(money().value(category_stats.depamt))
         if not use_header:
             if core.Main.output_[-1]:
                 category_rj = rjustify(category, cat_header_width)
@@ -209,43 +482,30 @@ def simple_stats(category, use_header = False):
 
 def more_stats(category):
     if check_cat_field():
-        min_in_key = category + 'min-in'
-        max_in_key = category + 'max-in'
-        num_in_key = category + 'num-in'
-        sum_in_key = category + 'sum-in'
-        min_out_key = category + 'min-out'
-        max_out_key = category + 'max-out'
-        num_out_key = category + 'num-out'
-        sum_out_key = category + 'sum-out'
-        general = False
-        keys = [min_in_key, max_in_key, num_in_key, sum_in_key, min_out_key, max_out_key, num_out_key, sum_out_key]
-        if not all (key in My.statvalues_[-1] for key in keys):
-            general = True
-            min_in_key = 'min-in'
-            max_in_key = 'max-in'
-            num_in_key = 'num-in'
-            sum_in_key = 'sum-in'
-            min_out_key = 'min-out'
-            max_out_key = 'max-out'
-            num_out_key = 'num-out'
-            sum_out_key = 'sum-out'
-        start = My.statvalues_[-1]['init']
-        finish = My.fulbal_[-1]
+        general = category not in My.categories_[-1]
+        category_stats = get_category_stats(category)
+        if My.init_[-1] is None:
+            core.Main.msg.error_message('Cannot run &stats --full before &init.')
+            return
+        mode = money()
+        value = mode.value
+        start = value(My.init_[-1])
+        finish = value(My.fulbal_[-1])
         change = round(100 * (finish - start) / start)
         change_str = 'decrease' if change < 0 else 'increase'
         change_str = 'change' if change == 0 else change_str
-        min_in = My.statvalues_[-1][min_in_key] if My.statvalues_[-1][min_in_key] != STATS_MAX else 0
-        num_in = My.statvalues_[-1][num_in_key]
-        sum_in = My.statvalues_[-1][sum_in_key]
+        min_in = value(category_stats.min_in) if category_stats.min_in != mode.stats_max else 0
+        num_in = category_stats.num_in
+        sum_in = value(category_stats.sum_in)
         avg_in = sum_in / num_in if num_in > 0 else 0
-        max_in = My.statvalues_[-1][max_in_key]
+        max_in = value(category_stats.max_in)
         header_in = core.Main.headers_[-1][My.incfield_[-1]]
         width_in = core.Main.width_[-1][My.incfield_[-1]]
-        min_out = My.statvalues_[-1][min_out_key] if My.statvalues_[-1][min_out_key] != STATS_MAX else 0
-        num_out = My.statvalues_[-1][num_out_key]
-        sum_out = My.statvalues_[-1][sum_out_key]
+        min_out = value(category_stats.min_out) if category_stats.min_out != mode.stats_max else 0
+        num_out = category_stats.num_out
+        sum_out = value(category_stats.sum_out)
         avg_out = sum_out / num_out if num_out > 0 else 0
-        max_out = My.statvalues_[-1][max_out_key]
+        max_out = value(category_stats.max_out)
         header_out = core.Main.headers_[-1][My.decfield_[-1]]
         width_out = core.Main.width_[-1][My.decfield_[-1]]
         if core.Main.output_[-1]:
@@ -265,6 +525,44 @@ def more_stats(category):
             print_line(f"{header_in_lj} min / avg / max = {min_in_rj} / {avg_in_rj} / {max_in_rj}")
             print_line()
 
+def period_stats(by, categories):
+    if None in [My.datefield_[-1], My.decfield_[-1], My.incfield_[-1]]:
+        core.Main.msg.error_message('Cannot run &stats --by when datefield, decfield or incfield is not set.')
+        return
+    value = money().value
+    periods = My.periods_[-1]
+    dec_header = core.Main.headers_[-1][My.decfield_[-1]]
+    dec_header_width = core.Main.width_[-1][My.decfield_[-1]]
+    inc_header = core.Main.headers_[-1][My.incfield_[-1]]
+    inc_header_width = core.Main.width_[-1][My.incfield_[-1]]
+    period_width = len('YYYY-MM-DD')
+    if core.Main.output_[-1]:
+        dec_header_rj = rjustify(dec_header, dec_header_width + 3)
+        inc_header_rj = rjustify(inc_header, inc_header_width + 3)
+        print_line(f"{rjustify('', period_width + 2)} {dec_header_rj}  {inc_header_rj}")
+    for category in categories:
+        # unknown categories show all entries, as in simple_stats
+        key = category if category in My.categories_[-1] else ''
+        rows = sorted((period, totals) for (row_by, period, row_key), totals in periods.items() if row_by == by and row_key == key)
+        if core.Main.output_[-1]:
+            print_line(f"{category}:")
+            for period, (payamt, depamt) in rows:
+                period_rj = rjustify(period, period_width)
+                catpay_currency_rj = rjustify(currency(value(payamt)), dec_header_width + 3)
+                catdep_currency_rj = rjustify(currency(value(depamt)), inc_header_width + 3)
+                print_line(f"{period_rj} | {catpay_currency_rj}  {catdep_currency_rj}")
+    if core.Main.output_[-1]:
+        print_line()
+
+def get_category_stats(category):
+    # stats of a category, or of all entries for unknown categories
+    categories = My.categories_[-1]
+    if category in categories:
+        return categories[category]
+    if '' in categories:
+        return categories['']
+    return CategoryStats(None, money())
+
 def check_cat_field():
     if My.catfield_[-1] is None:
         core.Main.msg.error_message('Cannot run &stats when catfield is not set.')
@@ -285,151 +583,90 @@ def parse_option(option, parameter):
         parse_my_directive(f"&init {parameter}")
         Cli.override_init = True
         result = [True, True]
+    elif option in ['-mm', '--money-mode']:
+        if parameter in MONEY_MODES:
+            set_money_mode(parameter)
+        else:
+            core.Main.msg.error_message(f"Invalid money mode: {parameter} (use float, cents or decimal)")
+        result = [True, True]
     return result
 
 ################################################################################
 # plugin-specific parsing
 ################################################################################
 
-def plugin_main(line):
-    out = pre_parse(line)
+AMOUNT_PREFIX_RE = re.compile(r'^\d\.-')
+
+def parse_amount(amount, mode):
+    if amount[1:3] == '.-':
+        amount = AMOUNT_PREFIX_RE.sub('', amount)
+    if amount.strip() == '':
+        return mode.zero
+    try:
+        return mode.convert(amount)
+    except ValueError:
+        return None
+
+####################
+
+def plugin_main(line, elements = None):
+    out = pre_parse(line, elements)
     if out is None:
         return
 
-    if core.Main.header_mode_:
-        if core.Main.output_[-1] and out is not None:
+    # bind the session state once for this line
+    main = core.Main.state()
+    my = My.state()
+
+    if main.header_mode_:
+        if main.output_[-1] and out is not None:
             print_line(out)
-        core.Main.header_mode_ = False
+        main.header_mode_ = False
         return
-    payamt = 0.0
-    depamt = 0.0
-    if My.decfield_[-1] is not None:
-        payamt = core.Main.elements_[My.decfield_[-1]]
-        payamt = re.sub(r'^\d\.-', '', payamt)
-        if payamt.strip() == '':
-            payamt = 0.0
+    # amounts are None when they are not numbers, which skips the stats
+    mode = money()
+    payamt = mode.zero
+    depamt = mode.zero
+    if my.decfield_[-1] is not None:
+        payamt = parse_amount(main.elements_[my.decfield_[-1]], mode)
     else:
         core.Main.msg.error_message('Decrement field is not set.')
-    if My.incfield_[-1] is not None:
-        depamt = core.Main.elements_[My.incfield_[-1]]
-        depamt = re.sub(r'^\d\.-', '', depamt)
-        if depamt.strip() == '':
-            depamt = 0.0
+    if my.incfield_[-1] is not None:
+        depamt = parse_amount(main.elements_[my.incfield_[-1]], mode)
     else:
         core.Main.msg.error_message('Increment field is not set.')
-    try:
+    if payamt is not None:
         # calculate running balance
-        My.fulbal_[-1] -= float(payamt)
-        My.fulbal_[-1] += float(depamt)
-
-        # record general category values
-        if not 'payamt' in My.catvalues_[-1]:
-            My.catvalues_[-1]['payamt'] = 0.0
-        My.catvalues_[-1]['payamt'] += float(payamt)
-        if not 'depamt' in My.catvalues_[-1]:
-            My.catvalues_[-1]['depamt'] = 0.0
-        My.catvalues_[-1]['depamt'] += float(depamt)
-
-        # record general stats values
-        if not 'min-in' in My.statvalues_[-1]:
-            My.statvalues_[-1]['min-in'] = STATS_MAX
-        if float(depamt) < My.statvalues_[-1]['min-in'] and float(payamt) == 0.0:
-            My.statvalues_[-1]['min-in'] = float(depamt)
-        if not 'max-in' in My.statvalues_[-1]:
-            My.statvalues_[-1]['max-in'] = STATS_MIN
-        if float(depamt) > My.statvalues_[-1]['max-in']:
-            My.statvalues_[-1]['max-in'] = float(depamt)
-        if not 'num-in' in My.statvalues_[-1]:
-            My.statvalues_[-1]['num-in'] = 0
-        if not 'sum-in' in My.statvalues_[-1]:
-            My.statvalues_[-1]['sum-in'] = 0
-        if float(depamt) > 0:
-            My.statvalues_[-1]['num-in'] += 1
-            My.statvalues_[-1]['sum-in'] += float(depamt)
-        if not 'min-out' in My.statvalues_[-1]:
-            My.statvalues_[-1]['min-out'] = STATS_MAX
-        if float(payamt) < My.statvalues_[-1]['min-out'] and float(depamt) == 0.0:
-            My.statvalues_[-1]['min-out'] = float(payamt)
-        if not 'max-out' in My.statvalues_[-1]:
-            My.statvalues_[-1]['max-out'] = STATS_MIN
-        if float(payamt) > My.statvalues_[-1]['max-out']:
-            My.statvalues_[-1]['max-out'] = float(payamt)
-        if not 'num-out' in My.statvalues_[-1]:
-            My.statvalues_[-1]['num-out'] = 0
-        if not 'sum-out' in My.statvalues_[-1]:
-            My.statvalues_[-1]['sum-out'] = 0
-        if float(payamt) > 0:
-            My.statvalues_[-1]['num-out'] += 1
-            My.statvalues_[-1]['sum-out'] += float(payamt)
-
-        # record specific category values
-        if My.clrfield_[-1] is not None and core.Main.elements_[My.clrfield_[-1]] != ' ':
-            My.clrbal_[-1] -= float(payamt)
-            My.clrbal_[-1] += float(depamt)
-        if My.catfield_[-1] is not None and core.Main.elements_[My.catfield_[-1]] != ' ':
-            for catkey in core.Main.elements_[My.catfield_[-1]].split():
-                catpay_key = catkey + 'payamt'
-                catdep_key = catkey + 'depamt'
-                if not catpay_key in My.catvalues_[-1]:
-                    My.catvalues_[-1][catpay_key] = 0.0
-                My.catvalues_[-1][catpay_key] += float(payamt)
-                if not catdep_key in My.catvalues_[-1]:
-                    My.catvalues_[-1][catdep_key] = 0.0
-                My.catvalues_[-1][catdep_key] += float(depamt)
-
-        # record specific stats values
-        if My.catfield_[-1] is not None and core.Main.elements_[My.catfield_[-1]] != ' ':
-            for statkey in core.Main.elements_[My.catfield_[-1]].split():
-                min_in_key = statkey + 'min-in'
-                max_in_key = statkey + 'max-in'
-                num_in_key = statkey + 'num-in'
-                sum_in_key = statkey + 'sum-in'
-                if not min_in_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][min_in_key] = 9999999.0
-                if float(depamt) < My.statvalues_[-1][min_in_key] and float(payamt) == 0.0:
-                    My.statvalues_[-1][min_in_key] = float(depamt)
-                if not max_in_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][max_in_key] = 0.0
-                if float(depamt) > My.statvalues_[-1][max_in_key]:
-                    My.statvalues_[-1][max_in_key] = float(depamt)
-                if not num_in_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][num_in_key] = 0
-                if not sum_in_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][sum_in_key] = 0
-                if float(depamt) > 0:
-                    My.statvalues_[-1][num_in_key] += 1
-                    My.statvalues_[-1][sum_in_key] += float(depamt)
-                min_out_key = statkey + 'min-out'
-                max_out_key = statkey + 'max-out'
-                num_out_key = statkey + 'num-out'
-                sum_out_key = statkey + 'sum-out'
-                if not min_out_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][min_out_key] = 9999999.0
-                if float(payamt) < My.statvalues_[-1][min_out_key] and float(depamt) == 0.0:
-                    My.statvalues_[-1][min_out_key] = float(payamt)
-                if not max_out_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][max_out_key] = 0.0
-                if float(payamt) > My.statvalues_[-1][max_out_key]:
-                    My.statvalues_[-1][max_out_key] = float(payamt)
-                if not num_out_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][num_out_key] = 0
-                if not sum_out_key in My.statvalues_[-1]:
-                    My.statvalues_[-1][sum_out_key] = 0
-                if float(payamt) > 0:
-                    My.statvalues_[-1][num_out_key] += 1
-                    My.statvalues_[-1][sum_out_key] += float(payamt)
-
-    except ValueError:
-        pass
-
-    if core.Main.output_[-1]:
-        fulbal = f"{My.fulbal_[-1]:8.2f}"
-        clrbal = f"{My.clrbal_[-1]:8.2f}"
-        if len(core.Main.formats_[-1]) == len(core.Main.elements_) + 2:
-            fulbal_index = len(core.Main.elements_)
-            clrbal_index = len(core.Main.elements_) + 1
-            fulbal = format_element_by_value(fulbal_index, My.fulbal_[-1])
-            clrbal = format_element_by_value(clrbal_index, My.clrbal_[-1])
+        my.fulbal_[-1] -= payamt
+        if depamt is not None:
+            my.fulbal_[-1] += depamt
+
+            # record general category values and stats
+            categories = my.categories_[-1]
+            add_category_stats(categories, '', payamt, depamt)
+
+            # record specific category values and stats
+            if my.clrfield_[-1] is not None and main.elements_[my.clrfield_[-1]] != ' ':
+                my.clrbal_[-1] -= payamt
+                my.clrbal_[-1] += depamt
+            row_categories = ()
+            if my.catfield_[-1] is not None and main.elements_[my.catfield_[-1]] != ' ':
+                row_categories = main.elements_[my.catfield_[-1]].split()
+                for category in row_categories:
+                    add_category_stats(categories, category, payamt, depamt)
+            if my.datefield_[-1] is not None:
+                add_period_stats(my.periods_[-1], row_periods(main.elements_[my.datefield_[-1]]), row_categories, payamt, depamt)
+
+    if main.output_[-1]:
+        fulbal_value = mode.value(my.fulbal_[-1])
+        clrbal_value = mode.value(my.clrbal_[-1])
+        fulbal = f"{fulbal_value:8.2f}"
+        clrbal = f"{clrbal_value:8.2f}"
+        if len(main.formats_[-1]) == len(main.elements_) + 2:
+            fulbal_index = len(main.elements_)
+            clrbal_index = len(main.elements_) + 1
+            fulbal = format_element_by_value(fulbal_index, fulbal_value)
+            clrbal = format_element_by_value(clrbal_index, clrbal_value)
         print_line(f"{out}{fulbal}{clrbal}")
 
 ####################
@@ -441,3 +678,7 @@ def parse_line(line):
         parse_my_directive(line)
     else:
         plugin_main(line)
+
+# rows released by &var.release
+def parse_elements(elements):
+    plugin_main(None, elements)
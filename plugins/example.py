@@ -14,11 +14,14 @@
 ################################################################################
 
 import core
+import core_directives
+import core_session
 from core_functions import pre_parse, map_elements, print_line
 
 def identify():
     return 'example'
 
+@core_session.session_state()
 class My():
     sums_ = []
     rows_ = None
@@ -27,6 +30,7 @@ def reset():
     My.sums_ = [[]]
     My.rows_ = 0
 
+@core_session.session_state(extra = ['example_option'])
 class Cli():
     example_option = True
 
@@ -37,6 +41,13 @@ def get_env():
         My.sums_
     ]
 
+# final values for crunchy.render
+def get_results():
+    return {
+        'rows': My.rows_,
+        'sums': list(My.sums_[-1])
+    }
+
 ################################################################################
 # parse plugin-specific directives, but pre-parse for core directives first
 ################################################################################
@@ -46,35 +57,36 @@ def parse_my_directive(line):
     p.pre_parse_directive(line)
     if p.done:
         return
-    argtrim = p.argtrim
-    cmd = p.cmd
+    p.dispatch(DIRECTIVES)
 
-    ####################
+DIRECTIVES = core_directives.DirectiveRegistry()
 
-    if cmd == 'example':
-        if argtrim:
-            core.Main.msg.info_message(f"This is an example directive output acting on '{argtrim}'")
-        else:
-            p.invalid_usage('&example <text>')
-
-    elif cmd == 'stats':
-        if argtrim:
-            if argtrim == 'sums':
-                if core.Main.output_[-1]:
-                    print_line(map_elements(My.sums_[-1]))
-            elif argtrim == 'averages':
-                averages = []
-                for avg_sum in My.sums_[-1]:
-                    averages.append(f"{avg_sum/My.rows_:8.3f}")
-                if core.Main.output_[-1]:
-                    print_line(map_elements(averages))
-        else:
-            p.invalid_usage('&stats <type>')
+####################
 
-    ####################
+@DIRECTIVES.register('example')
+def directive_example(p):
+    if p.argtrim:
+        core.Main.msg.info_message(f"This is an example directive output acting on '{p.argtrim}'")
+    else:
+        p.invalid_usage('&example <text>')
+
+####################
 
+@DIRECTIVES.register('stats')
+def directive_stats(p):
+    argtrim = p.argtrim
+    if argtrim:
+        if argtrim == 'sums':
+            if core.Main.output_[-1]:
+                print_line(map_elements(My.sums_[-1]))
+        elif argtrim == 'averages':
+            averages = []
+            for avg_sum in My.sums_[-1]:
+                averages.append(f"{avg_sum/My.rows_:8.3f}")
+            if core.Main.output_[-1]:
+                print_line(map_elements(averages))
     else:
-        p.invalid_directive()
+        p.invalid_usage('&stats <type>')
 
 ################################################################################
 # add command-line options just for this plugin
@@ -98,8 +110,8 @@ def parse_option(option, parameter):
 # plugin-specific parsing
 ################################################################################
 
-def plugin_main(line):
-    out = pre_parse(line)
+def plugin_main(line, elements = None):
+    out = pre_parse(line, elements)
     if core.Main.header_mode_:
         if core.Main.output_[-1] and out is not None:
             print_line(out)
@@ -125,3 +137,7 @@ def parse_line(line):
         parse_my_directive(line)
     else:
         plugin_main(line)
+
+# rows released by &var.release
+def parse_elements(elements):
+    plugin_main(None, elements)
@@ -14,10 +14,12 @@
 ################################################################################
 
 import core
+import core_session
 
 def identify():
     return 'shell'
 
+@core_session.session_state()
 class My():
     pass # placeholder
 def get_env():
@@ -15,34 +15,85 @@
 
 import core
 import bridge
+import core_session
 import core_functions
 
 def reset():
     core.Testing.testing_ = [False]
     core.Testing.test_filename_ = [None]
-    core.Testing.test_f_ = [None]
+    core.Testing.test_comparator_ = [None]
     core.Testing.test_pause_ = [False]
     core.Testing.test_verbose_ = [False]
     core.Testing.test_pass_ = [0]
     core.Testing.test_fail_ = [0]
     core.Testing.debug_print_mode = True
+    core.Testing.results_ = []
+
+################################################################################
+# compare output against the expected test file
+#
+#    - The expected file is read in one pass and walked with an index cursor.
+#    - Passing lines are only formatted into messages in verbose mode.
+#    - In quiet mode, only the first few differences are reported in detail.
+################################################################################
+
+class TestComparator():
+
+    def __init__(self, filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            self.lines = f.read().split('\n')
+        if self.lines[-1] == '':
+            self.lines.pop()
+        self.cursor = 0
+        self.diffs = 0
+
+    def at_end(self):
+        return self.cursor >= len(self.lines)
+
+    def next_line(self):
+        self.cursor += 1
+        return self.lines[self.cursor - 1]
+
+    def remaining(self):
+        return len(self.lines) - self.cursor
+
+def test_compare(line):
+    comparator = core.Testing.test_comparator_[-1]
+    if comparator.at_end():
+        test_message('Unexpected EOF reached; stopping test.', True)
+        test_stop(True)
+        return
+    line = line.replace('\n', '')
+    test_line = comparator.next_line()
+    if line == test_line:
+        core.Testing.test_pass_[-1] += 1
+        if core.Testing.test_verbose_[-1]:
+            test_message(f"Passed: {line}")
+    else:
+        core.Testing.test_fail_[-1] += 1
+        comparator.diffs += 1
+        if comparator.diffs <= core.Testing.max_reported_diffs or core.Testing.test_verbose_[-1]:
+            test_message(f"Line {comparator.cursor} expected: '{test_line}'", True)
+            test_message(f"Line {comparator.cursor} received: '{line}'", True)
 
 def test_message(message, verbose = False):
     if core.Testing.test_verbose_[-1] or verbose:
-        print(core.ANSI.FG_YELLOW + '<T> ' + message + core.ANSI.FG_DEFAULT)
+        core.Main.writer.write(core.ANSI.FG_YELLOW + '<T> ' + message + core.ANSI.FG_DEFAULT)
 
 def test_stop(verbose = False):
     core.Testing.testing_[-1] = False
     core.Testing.test_pause_[-1] = False
-    if core.Testing.test_f_[-1] is not None:
-        eof_test = core.Testing.test_f_[-1].readline()
-        if eof_test != '':
+    comparator = core.Testing.test_comparator_[-1]
+    if comparator is not None:
+        remaining = comparator.remaining()
+        if remaining > 0:
             test_message('The test was unexpectedly interrupted.', True)
-            while eof_test != '':
-                core.Testing.test_fail_[-1] += 1
-                eof_test = core.Testing.test_f_[-1].readline()
-        core.Testing.test_f_[-1].close()
-    core.Testing.test_f_[-1] = None
+            core.Testing.test_fail_[-1] += remaining
+        unreported = comparator.diffs - core.Testing.max_reported_diffs
+        if unreported > 0 and not core.Testing.test_verbose_[-1]:
+            s = 's' if unreported != 1 else ''
+            test_message(f"{unreported} more difference{s} not shown; use &test verbose to see them all.", True)
+    core.Testing.test_comparator_[-1] = None
     test_message('Test stopped.', verbose)
     testfile = core.Testing.test_filename_[-1]
 
@@ -64,6 +115,9 @@ def test_stop(verbose = False):
         failed = str(core.Testing.test_fail_[-1]) + ' failed :: '
     text_offset = 0 if total < 1000 else 2 # make room for big numbers
     test_message(core_functions.rjustify(tested, 18 + text_offset) + core_functions.rjustify(passed, 24 + text_offset) + failed + testfile, True)
+
+    # keep the counts for anyone running tests in bulk (e.g., crunchy_test.py)
+    core.Testing.results_.append((testfile, core.Testing.test_pass_[-1], core.Testing.test_fail_[-1]))
     core.Testing.test_filename_[-1] = ''
 
 def test_versions(ranges):
@@ -156,7 +210,11 @@ def list_vars_(class_obj, filters, fullname = False, classname = None):
         if len(plugin_classname) > len(classname):
             class_width = len(plugin_classname)
 
-    class_vars = vars(class_obj)
+    # session state classes keep their variables on the facade class
+    if isinstance(class_obj, core_session.Facade):
+        class_vars = vars(type(class_obj))
+    else:
+        class_vars = vars(class_obj)
 
     # check for partial matches
     partial_matches = []
@@ -180,7 +238,7 @@ def list_vars_(class_obj, filters, fullname = False, classname = None):
                     var = var[:-1]
 
                 # passed the filters
-                print(f"{classname.rjust(class_width)}.{var.ljust(var_width)} = {attr}")
+                core.Main.writer.write(f"{classname.rjust(class_width)}.{var.ljust(var_width)} = {attr}")
 
 def debug(argv, fullname = False):
     if argv is not None:
@@ -194,4 +252,4 @@ def debug(argv, fullname = False):
 
 def debug_print(message = ''):
     if core.Testing.debug_print_mode:
-        print(message)
+        core.Main.writer.write(message)
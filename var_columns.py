@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Crunchy Report Generator
+#
+# Crunch Really Useful Numbers Coded Hackishly
+#
+# Column expressions for &var.transform and row joins for &var.combine
+#
+# Copyright (c) 2000, 2022, 2023, 2024 Andy Warmack
+# This file is part of Crunchy Report Generator, licensed under the MIT License.
+# See the LICENSE file in the project root for more information.
+################################################################################
+
+import ast
+import functools
+import importlib
+import operator
+import re
+
+numpy = None
+NUMPY_IMPORTED = None # not tried yet (see use_numpy)
+
+def use_numpy():
+    # numpy is slow to import, so it is only imported for the first transform
+    global numpy, NUMPY_IMPORTED # pylint: disable=global-statement
+    if NUMPY_IMPORTED is None:
+        try:
+            numpy = importlib.import_module('numpy')
+            NUMPY_IMPORTED = True # numpy module successfully imported
+        except ImportError:
+            NUMPY_IMPORTED = False # missing numpy module
+    return NUMPY_IMPORTED
+
+################################################################################
+# transform steps
+#
+#    - Steps are separated by semicolons and run in order:
+#
+#         $N = <expression>     replace column N, or add it after the last one
+#         where <expression>    keep the rows where the expression is true
+#         sort <expression>     sort the rows (add 'desc' for descending)
+#
+#    - Expressions use Python syntax for arithmetic, comparisons, and/or/not,
+#      numbers, quoted strings, abs(), and round(), with $N for column N
+#      (counting from 0).  Nothing else is allowed.
+#    - A column is read as numbers if every value in it is a number or blank
+#      (blanks count as 0); otherwise it is read as strings.
+#    - Whole columns are computed at once, with NumPy arrays when available
+#      and Python lists otherwise.  Both give the same results.
+################################################################################
+
+COLUMN_RE = re.compile(r'\$(\d+)')
+ASSIGN_RE = re.compile(r'^\$(\d+)\s*=(?!=)\s*(.*)$')
+BLANKS = (None, '', ' ')
+
+def power(x, y):
+    # as in Python, except that there are no complex results
+    result = x ** y
+    if isinstance(result, complex):
+        raise ValueError('math domain error')
+    return result
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: power
+}
+DIVISIONS = (operator.truediv, operator.floordiv, operator.mod)
+ARITHMETIC = tuple(BINARY_OPERATORS.values())
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos
+}
+
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Call, ast.Name, ast.Constant, ast.Load,
+    ast.And, ast.Or, ast.Not, *BINARY_OPERATORS, *COMPARE_OPERATORS, *UNARY_OPERATORS)
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(expression):
+    # parse an expression and make sure it only uses what is allowed
+
+    if expression.strip() == '':
+        raise ValueError('missing expression')
+    try:
+        tree = ast.parse(COLUMN_RE.sub(r'_c\1', expression.strip()), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"syntax error in '{expression.strip()}'") from e
+    functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    for node in ast.walk(tree):
+        if id(node) in functions:
+            continue
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"'{expression.strip()}' is not a column expression")
+        if isinstance(node, ast.Name) and not re.match(r'^_c\d+$', node.id):
+            raise ValueError(f"unknown name '{node.id}' (use $N for column N)")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, str)):
+            raise ValueError(f"unsupported value {node.value!r}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in ('abs', 'round') or node.keywords:
+                raise ValueError(f"unsupported function in '{expression.strip()}'")
+            if node.func.id == 'abs' and len(node.args) != 1:
+                raise ValueError('abs() takes one value')
+            if node.func.id == 'round' and (len(node.args) not in (1, 2) or (len(node.args) == 2 and not isinstance(node.args[1], ast.Constant))):
+                raise ValueError('round() takes a value and an optional number of digits')
+    return tree.body
+
+@functools.lru_cache(maxsize=256)
+def compile_steps(text):
+    # split the steps and compile their expressions once
+
+    steps = []
+    for step in text.split(';'):
+        step = step.strip()
+        if step == '':
+            continue
+        m = ASSIGN_RE.match(step)
+        if m is not None:
+            steps.append(('set', int(m.group(1)), compile_expression(m.group(2))))
+        elif step.startswith('where '):
+            steps.append(('where', None, compile_expression(step[6:])))
+        elif step.startswith('sort '):
+            descending = step.endswith(' desc')
+            steps.append(('sort', descending, compile_expression(step[5:-5] if descending else step[5:])))
+        else:
+            raise ValueError(f"unrecognized step '{step}'")
+    return steps
+
+def transform(columns, lengths, text):
+    # run the steps over a table of columns, returning the new columns and row lengths
+
+    table = NumpyTable(columns, lengths) if use_numpy() else Table(columns, lengths)
+    for kind, argument, expression in compile_steps(text):
+        values = table.evaluate(expression)
+        if kind == 'set':
+            table.set_column(argument, values)
+        elif kind == 'where':
+            table.select(table.true_rows(values))
+        else:
+            keys = table.values(values)
+            table.select(sorted(range(table.size), key=keys.__getitem__, reverse=argument))
+    return table.columns, table.lengths
+
+################################################################################
+# tables of columns
+#
+#    - Table computes with Python lists; NumpyTable overrides the column
+#      operations with NumPy arrays.
+#    - A computed value is either a whole column or a single value (from
+#      constants) that applies to every row.
+################################################################################
+
+class Table():
+
+    def __init__(self, columns, lengths):
+        self.columns = [list(column) for column in columns]
+        self.lengths = list(lengths)
+        self.size = len(self.lengths)
+        self.typed = {}
+
+    ####################
+
+    def evaluate(self, node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.column(int(node.id[2:]))
+        if isinstance(node, ast.BinOp):
+            return self.binary(BINARY_OPERATORS[type(node.op)], self.evaluate(node.left), self.evaluate(node.right))
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return self.unary(operator.not_, self.evaluate(node.operand))
+            return self.unary(UNARY_OPERATORS[type(node.op)], self.evaluate(node.operand))
+        if isinstance(node, ast.BoolOp):
+            function = self.both if isinstance(node.op, ast.And) else self.either
+            result = self.evaluate(node.values[0])
+            for value in node.values[1:]:
+                result = function(result, self.evaluate(value))
+            return result
+        if isinstance(node, ast.Compare):
+            # a < b < c is a < b and b < c
+            left = self.evaluate(node.left)
+            result = True
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.evaluate(comparator)
+                result = self.both(result, self.binary(COMPARE_OPERATORS[type(op)], left, right))
+                left = right
+            return result
+        args = [self.evaluate(arg) for arg in node.args]
+        if node.func.id == 'abs':
+            return self.unary(abs, args[0])
+        if len(args) == 2:
+            return self.unary(lambda x: round(x, args[1]), args[0])
+        return self.unary(round, args[0])
+
+    ####################
+
+    def column(self, index):
+        if index >= len(self.columns):
+            raise ValueError(f"there is no column ${index}")
+        if index not in self.typed:
+            self.typed[index] = read_column(self.columns[index])
+        return self.typed[index]
+
+    def set_column(self, index, values):
+        if index > len(self.columns):
+            raise ValueError(f"${index} would leave a gap after the last column (${len(self.columns) - 1})")
+        cells = [format_cell(value) for value in self.values(values)]
+        if index == len(self.columns):
+            self.columns.append(cells)
+        else:
+            self.columns[index] = cells
+        for i, length in enumerate(self.lengths):
+            if length <= index:
+                # short rows are padded with blanks up to the new value
+                for column in self.columns[length:index]:
+                    if column[i] is None:
+                        column[i] = ' '
+                self.lengths[i] = index + 1
+        self.typed = {}
+
+    def select(self, rows):
+        # keep (and reorder) the rows by index
+        self.columns = [[column[i] for i in rows] for column in self.columns]
+        self.lengths = [self.lengths[i] for i in rows]
+        self.size = len(self.lengths)
+        self.typed = {}
+
+    ####################
+
+    def binary(self, function, a, b):
+        a_column = isinstance(a, list)
+        b_column = isinstance(b, list)
+        if a_column and b_column:
+            return [function(x, y) for x, y in zip(a, b)]
+        if a_column:
+            return [function(x, b) for x in a]
+        if b_column:
+            return [function(a, y) for y in b]
+        return function(a, b)
+
+    def unary(self, function, a):
+        if isinstance(a, list):
+            return [function(x) for x in a]
+        return function(a)
+
+    def both(self, a, b):
+        return self.binary(lambda x, y: bool(x) and bool(y), a, b)
+
+    def either(self, a, b):
+        return self.binary(lambda x, y: bool(x) or bool(y), a, b)
+
+    def values(self, values):
+        # a computed value as a list with one value per row
+        if isinstance(values, list):
+            return values
+        return [values] * self.size
+
+    def true_rows(self, values):
+        return [i for i, value in enumerate(self.values(values)) if value]
+
+class NumpyTable(Table):
+
+    def column(self, index):
+        if index >= len(self.columns):
+            raise ValueError(f"there is no column ${index}")
+        if index not in self.typed:
+            values = read_column(self.columns[index])
+            dtype = float if values and isinstance(values[0], float) else object
+            self.typed[index] = numpy.array(values, dtype=dtype)
+        return self.typed[index]
+
+    def binary(self, function, a, b):
+        a_column = isinstance(a, numpy.ndarray)
+        b_column = isinstance(b, numpy.ndarray)
+        if not a_column and not b_column:
+            return function(a, b)
+        if function in ARITHMETIC:
+            a = self.countable(a)
+            b = self.countable(b)
+        if function is power or self.objects(a) or self.objects(b) or \
+                (function in DIVISIONS and numpy.any(numpy.asarray(b) == 0)):
+            # edge cases (overflow, negative roots, strings, bools, division by
+            # zero) follow Python value by value, raising the same error for the same row
+            return numpy.array(Table.binary(self, function, self.listed(a), self.listed(b)), dtype=object)
+        with numpy.errstate(all='ignore'):
+            return function(a, b)
+
+    def unary(self, function, a):
+        if not isinstance(a, numpy.ndarray):
+            return function(a)
+        if function is operator.not_:
+            return numpy.logical_not(a.astype(bool))
+        if function in (operator.neg, operator.pos, abs):
+            return function(self.countable(a))
+        return numpy.array([function(x) for x in a.tolist()], dtype=object)
+
+    def both(self, a, b):
+        if not isinstance(a, numpy.ndarray) and not isinstance(b, numpy.ndarray):
+            return Table.both(self, a, b)
+        return self.binary(numpy.logical_and, self.truth(a), self.truth(b))
+
+    def either(self, a, b):
+        if not isinstance(a, numpy.ndarray) and not isinstance(b, numpy.ndarray):
+            return Table.either(self, a, b)
+        return self.binary(numpy.logical_or, self.truth(a), self.truth(b))
+
+    def objects(self, a):
+        return isinstance(a, str) or (isinstance(a, numpy.ndarray) and a.dtype == object)
+
+    def countable(self, a):
+        # bool arrays add up as a logical or, and cannot be negated, so they
+        # are computed with Python bools (which count as 0 and 1), as in Table
+        if isinstance(a, numpy.ndarray) and a.dtype == bool:
+            return a.astype(object)
+        return a
+
+    def truth(self, a):
+        return a.astype(bool) if isinstance(a, numpy.ndarray) else bool(a)
+
+    def listed(self, a):
+        return a.tolist() if isinstance(a, numpy.ndarray) else a
+
+    def values(self, values):
+        if isinstance(values, numpy.ndarray):
+            return values.tolist()
+        return [values] * self.size
+
+    def true_rows(self, values):
+        if isinstance(values, numpy.ndarray):
+            return numpy.flatnonzero(values.astype(bool)).tolist()
+        return list(range(self.size)) if values else []
+
+def read_column(cells):
+    # numbers if every value is a number or blank, strings otherwise
+    try:
+        return [0.0 if cell in BLANKS else float(cell) for cell in cells]
+    except ValueError:
+        return [' ' if cell is None else cell for cell in cells]
+
+def format_cell(value):
+    # computed values go back into the captured rows as strings
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    return str(value)
+
+################################################################################
+# combining captured rows
+################################################################################
+
+def join_rows(left, right, index):
+    # rows of left followed by the other values of each right row with the same value in column index
+
+    matches = {}
+    for row in right:
+        if index < len(row):
+            matches.setdefault(row[index], []).append(row[:index] + row[index + 1:])
+    joined = []
+    for row in left:
+        if index < len(row):
+            for match in matches.get(row[index], ()):
+                joined.append(row + match)
+    return joined
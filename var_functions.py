@@ -14,12 +14,19 @@
 ################################################################################
 
 import ast
+import bisect
+import functools
+import math
 import re
 import statistics
+import sys
+from array import array
 from datetime import datetime
+from fractions import Fraction
 
 import core
 import bridge
+import var_columns
 
 # non-printable null characters for internal parsing
 SPACE_DELIM = '\x00' # \s
@@ -33,44 +40,68 @@ RBRACKET_DELIM = '\x05' # ]
 # function support for user-definable variables
 ################################################################################
 
+REFERENCE_RE = re.compile(r'{([a-zA-Z0-9:]+)}')
+
 def parse_references(line):
     # find variable references and substitute values for them
 
-    pattern = r'{([a-zA-Z0-9:]+)}'
-    line = re.sub(pattern, lambda m: parse_reference(m.group(1)), line)
-    return line
+    if '{' not in line:
+        return line
+    parts = split_references(line)
+    if len(parts) == 1:
+        return line
+    expanded = list(parts)
+    for i in range(1, len(parts), 2):
+        expanded[i] = parse_reference(parts[i])
+    return ''.join(expanded)
+
+@functools.lru_cache(maxsize=4096)
+def split_references(line):
+    # split a line into literal text (even indexes) and references (odd indexes)
+
+    return tuple(REFERENCE_RE.split(line))
 
 def parse_reference(ref):
     # look up a single variable reference and return a value
 
+    argument = None
     if ':' in ref:
-        var, function = ref.split(':')
+        var, function = ref.split(':', 1)
+        if function.startswith('percentile:'):
+            function, argument = function.split(':')
+        elif ':' in function:
+            raise ValueError(f"Invalid reference: {ref}")
     else:
         var = ref
         function = None
+    if function in AGGREGATES:
+        result = AGGREGATES[function](get_stats(var), argument)
+        if function in FORMATTED_AGGREGATES:
+            result = core.Main.float_format_.format(result)
+        return str(result)
     val = get_var(var)
-    numeric_val = [v if isinstance(v, (int, float)) else 0 for v in val]
     result = val
-    if function == 'average':
-        result = core.Main.float_format_.format(statistics.mean(numeric_val))
-    elif function == 'count':
-        result = len(val)
-    elif function == 'max':
-        result = max(numeric_val)
-    elif function == 'min':
-        result = min(numeric_val)
-    elif function == 'reverse':
+    if function == 'reverse':
         val.reverse()
         result = val
     elif function == 'sort':
         val.sort()
         result = val
-    elif function == 'stddev':
-        result = core.Main.float_format_.format(statistics.stdev(numeric_val))
-    if isinstance(result, list) and len(result) == 1:
+    if isinstance(result, (list, CaptureBuffer)) and len(result) == 1:
         result = result[0]
     return str(result)
 
+AGGREGATES = {
+    'average': lambda stats, argument: stats.mean(),
+    'count': lambda stats, argument: stats.count,
+    'max': lambda stats, argument: stats.max(),
+    'median': lambda stats, argument: stats.median(),
+    'min': lambda stats, argument: stats.min(),
+    'percentile': lambda stats, argument: stats.percentile(argument),
+    'stddev': lambda stats, argument: stats.stdev()
+}
+FORMATTED_AGGREGATES = ('average', 'median', 'percentile', 'stddev')
+
 def process_until(line):
     # slot values into variable(s) specified by key(s)
 
@@ -99,6 +130,71 @@ def process_until(line):
 def get_values(line):
     # get an array of values from a comma-delimited or space-delimited string with possible quotes or brackets
 
+    values = tokenize_values(line)
+    if values is not None:
+        return values
+    return parse_values(line)
+
+########################################
+
+VALUE_TOKEN_RE = re.compile(r'''(?P<sep>\s+|,\s*)|(?P<open>\[)|(?P<close>\])|'(?P<single>(?:[^'"\\\s\x00-\x05]| )+)'|"(?P<double>(?:[^'"\\\s\x00-\x05]| )+)"|(?P<word>[^\s\[\]'",]+)''')
+ESCAPES_RE = re.compile(r'[\\\x00-\x05]')
+
+def tokenize_values(line):
+    # get values in a single pass, or None unless they are well formed (numbers,
+    # bare words, quoted strings, and brackets, separated by whitespace or a
+    # comma); parse_values handles the rest, including dates and error messages
+
+    if line.startswith('@') or line.startswith('date:') or ESCAPES_RE.search(line) is not None:
+        return None
+    values = []
+    stack = []
+    previous = 'start'
+    pos = 0
+    end = len(line)
+    while pos < end:
+        m = VALUE_TOKEN_RE.match(line, pos)
+        if m is None:
+            return None
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == 'sep':
+            if previous in ('start', 'open', 'sep'):
+                return None # leading or doubled separator
+        elif kind == 'open':
+            if previous not in ('start', 'open', 'sep', 'close'):
+                return None
+            stack.append(values)
+            values.append([])
+            values = values[-1]
+        elif kind == 'close':
+            if not stack:
+                return None
+            values = stack.pop()
+        else:
+            if previous not in ('start', 'open', 'sep'):
+                return None # values need a separator between them
+            value = m.group(kind)
+            if value.startswith('@') or value.startswith('date:'):
+                return None
+            if kind == 'word':
+                typed = type_by_value(value)
+                if isinstance(typed, float) and not math.isfinite(typed):
+                    return None
+                if not isinstance(typed, str):
+                    value = typed
+            values.append(value)
+            kind = 'value'
+        previous = kind
+    if stack:
+        return None
+    return values
+
+########################################
+
+def parse_values(line):
+    # get values by rewriting the string as a Python list and evaluating it
+
     # save original copy for error messages
     original_line = line
 
@@ -140,20 +236,19 @@ def get_values(line):
 def type_by_value(var_value):
     # convert string values to types based on value patterns
 
-    # list
-    if isinstance(var_value, list):
-        return var_value
-
-    # datetime
+    # strings (see classify_string)
     if isinstance(var_value, str):
-        var_value = var_value.strip("'").strip('"').replace(SPACE_DELIM, ' ').replace(COMMA_DELIM, ',')
-    if str(var_value).startswith('date:') or str(var_value).startswith('@'):
+        kind, var_value = classify_string(var_value)
+        if kind is not DATE_LITERAL:
+            return var_value
         try:
             datestr = var_value.replace('date:', '').replace('@', '')
             return core.Main.DateUtil.parse(datestr)
         except ValueError:
-            pass
-    if isinstance(var_value, datetime):
+            return var_value
+
+    # list, datetime, or number
+    if isinstance(var_value, (list, datetime)) or type(var_value) in (int, float):
         return var_value
 
     # integer
@@ -181,6 +276,8 @@ def get_var(var_key):
     # retrieve variable by key
 
     var = core.Main.variables_[-1][var_key]
+    if isinstance(var, CaptureBuffer):
+        return var # captured rows hold only strings
     for i,element in enumerate(var):
         if isinstance(element, datetime):
             var[i] = element.strftime(core.Main.datetime_format_)
@@ -192,20 +289,21 @@ def set_var(var_key, var_values):
     # store values into variable(s) by key(s)
 
     var_keys = split_string(var_key)
+    variables = core.Main.variables_[-1]
     if len(var_keys) == 1:
-        core.Main.variables_[-1][var_keys[0]] = [type_by_value(value) for value in var_values]
+        variables[var_keys[0]] = Variable((type_by_value(value) for value in var_values), variables)
     else:
         for key in var_keys:
-            core.Main.variables_[-1][key] = []
+            variables[key] = Variable(owner = variables)
         k = 0
         for this_value in var_values:
             if k >= len(var_keys):
                 k = 0
             this_var = [type_by_value(value) for value in split_string(this_value)]
             if isinstance(this_var[0], list):
-                core.Main.variables_[-1][var_keys[k]] += this_var[0] # append a list
+                variables[var_keys[k]] += this_var[0] # append a list
             else:
-                core.Main.variables_[-1][var_keys[k]] += this_var # append a non-list value
+                variables[var_keys[k]] += this_var # append a non-list value
             k += 1
 
 ########################################
@@ -221,7 +319,8 @@ def push_var(var_key, var_values):
     # push a value onto a list variable
 
     if check_var(var_key):
-        core.Main.variables_[-1][var_key] = [type_by_value(value) for value in core.Main.variables_[-1][var_key] + var_values]
+        # values already in the variable are typed, so only convert the new ones
+        own_var(var_key).extend(type_by_value(value) for value in var_values)
 
 ########################################
 
@@ -241,7 +340,9 @@ def pop_var(var_key):
     keys = split_string(var_key)
     for key in keys:
         if check_var(key):
-            core.Main.variables_[-1][key] = core.Main.variables_[-1][key][:-1]
+            var = own_var(key)
+            if var:
+                var.pop()
 
 ########################################
 
@@ -316,6 +417,377 @@ def all_vars():
 
     return core.Main.variables_[-1].items()
 
+################################################################################
+# classify string values by their characters
+#
+#    - A string is an integer or float only if converting it and back gives
+#      the same string, so only the forms that Python itself writes need to
+#      be recognized (e.g., 12, -3, 2.5, 1e-05, 1.5e+16, inf, nan).
+#    - Results are cached, since the same literals tend to come up again
+#      (e.g., in loops, --until blocks, and captured data).
+#    - Dates depend on the date format and dateutil, so they are only
+#      recognized here and parsed by the caller.
+################################################################################
+
+DATE_LITERAL = object()
+INT_RE = re.compile(r'0|-?[1-9][0-9]*')
+FLOAT_RE = re.compile(r'-?(?:[0-9]+\.[0-9]+(?:e[-+][0-9]+)?|[0-9]+e[-+][0-9]+|inf)|nan')
+
+@functools.lru_cache(maxsize=4096)
+def classify_string(var_value):
+    # return a (kind, value) pair: kind is DATE_LITERAL or the type of the value
+
+    var_value = var_value.strip("'").strip('"').replace(SPACE_DELIM, ' ').replace(COMMA_DELIM, ',')
+    if var_value.startswith('date:') or var_value.startswith('@'):
+        return DATE_LITERAL, var_value
+    if INT_RE.fullmatch(var_value):
+        try:
+            return int, int(var_value)
+        except ValueError: # too many digits to convert
+            return str, var_value
+    if FLOAT_RE.fullmatch(var_value):
+        float_value = float(var_value)
+        if str(float_value) == var_value:
+            return float, float_value
+    return str, var_value
+
+################################################################################
+# running aggregates for variables
+#
+#    - Variables are Variable lists, which keep their aggregates up to date as
+#      values are appended or popped, so references such as {x:average} don't
+#      rescan the list.
+#    - Aggregates are created on first reference and maintained from then on.
+#    - Values that are not numbers count as 0, as they always have.
+#    - Sums are kept exactly (integers, or fractions once floats show up), so
+#      results are identical to the statistics module's.
+#    - The ordered copy of the values backs min, max, median, and percentile.
+#    - A variable belongs to one environment layer; own_var() copies a
+#      variable that belongs to an outer layer before changing it in place.
+################################################################################
+
+def numeric(value):
+    return value if isinstance(value, (int, float)) else 0
+
+class Variable(list):
+    __slots__ = ('owner', 'stats')
+
+    def __init__(self, values = (), owner = None):
+        super().__init__(values)
+        self.owner = owner
+        self.stats = None
+
+    def append(self, value):
+        super().append(value)
+        if self.stats is not None:
+            self.stats.add(value)
+
+    def extend(self, values):
+        start = len(self)
+        super().extend(values)
+        if self.stats is not None:
+            for value in self[start:]:
+                self.stats.add(value)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def pop(self, index = -1):
+        if index not in (-1, len(self) - 1):
+            self.stats = None
+            return super().pop(index)
+        value = super().pop()
+        if self.stats is not None:
+            self.stats.remove(value)
+        return value
+
+    def __setitem__(self, index, value):
+        if self.stats is not None:
+            if isinstance(index, slice) or type(numeric(self[index])) is not type(numeric(value)) or numeric(self[index]) != numeric(value):
+                self.stats = None
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self.stats = None
+        super().__delitem__(index)
+
+    def insert(self, index, value):
+        self.stats = None
+        super().insert(index, value)
+
+    def remove(self, value):
+        self.stats = None
+        super().remove(value)
+
+    def clear(self):
+        self.stats = None
+        super().clear()
+
+    def copy(self):
+        return Variable(self)
+
+    def aggregates(self):
+        if self.stats is None:
+            self.stats = Aggregates(self)
+        return self.stats
+
+class Aggregates():
+    __slots__ = ('count', 'floats', 'special', 'total', 'squares', 'ordered')
+
+    def __init__(self, values):
+        self.count = 0
+        self.floats = 0
+        self.special = 0
+        self.total = 0
+        self.squares = 0
+        for value in values:
+            self.add_sum(numeric(value))
+        self.ordered = sorted(numeric(value) for value in values)
+
+    def add_sum(self, x):
+        self.count += 1
+        if isinstance(x, float):
+            self.floats += 1
+            if not math.isfinite(x):
+                self.special += 1
+                return
+            x = Fraction(x)
+        else:
+            x = int(x)
+        self.total += x
+        self.squares += x * x
+
+    def remove_sum(self, x):
+        self.count -= 1
+        if isinstance(x, float):
+            self.floats -= 1
+            if not math.isfinite(x):
+                self.special -= 1
+                return
+            x = Fraction(x)
+        else:
+            x = int(x)
+        self.total -= x
+        self.squares -= x * x
+
+    def add(self, value):
+        x = numeric(value)
+        self.add_sum(x)
+        bisect.insort(self.ordered, x)
+
+    def remove(self, value):
+        x = numeric(value)
+        self.remove_sum(x)
+        # equal values keep their list order, so the last one is the rightmost
+        del self.ordered[bisect.bisect_right(self.ordered, x) - 1]
+
+    def mean(self):
+        if self.count < 1:
+            raise statistics.StatisticsError('mean requires at least one data point')
+        if self.special:
+            return statistics.mean(self.ordered)
+        mean = Fraction(self.total, self.count)
+        if not self.floats and mean.denominator == 1:
+            return int(mean)
+        return float(mean)
+
+    def stdev(self):
+        if self.count < 2:
+            raise statistics.StatisticsError('stdev requires at least two data points')
+        if self.special:
+            return statistics.stdev(self.ordered)
+        total = Fraction(self.total)
+        variance = (self.squares - total * total / self.count) / (self.count - 1)
+        return sqrt_of_fraction(variance.numerator, variance.denominator)
+
+    def min(self):
+        if not self.ordered:
+            raise ValueError('min() arg is an empty sequence')
+        return self.ordered[0]
+
+    def max(self):
+        if not self.ordered:
+            raise ValueError('max() arg is an empty sequence')
+        # the first of equal maximums, as max() would return
+        return self.ordered[bisect.bisect_left(self.ordered, self.ordered[-1])]
+
+    def median(self):
+        if not self.ordered:
+            raise statistics.StatisticsError('no median for empty data')
+        i = self.count // 2
+        if self.count % 2 == 1:
+            return self.ordered[i]
+        return (self.ordered[i - 1] + self.ordered[i]) / 2
+
+    def percentile(self, argument):
+        # linear interpolation between the closest ranks
+        if argument is None or not argument.isdigit() or int(argument) > 100:
+            raise ValueError(f"Invalid percentile: {argument}")
+        if not self.ordered:
+            raise statistics.StatisticsError('no percentile for empty data')
+        rank = Fraction((self.count - 1) * int(argument), 100)
+        i = int(rank)
+        if rank == i:
+            return self.ordered[i]
+        low = self.ordered[i]
+        return low + (self.ordered[i + 1] - low) * float(rank - i)
+
+    def copy(self):
+        stats = Aggregates(())
+        for name in self.__slots__:
+            setattr(stats, name, getattr(self, name))
+        stats.ordered = self.ordered.copy()
+        return stats
+
+def sqrt_of_fraction(n, m):
+    # correctly rounded square root of n/m, as statistics.stdev computes it
+    q = (n.bit_length() - m.bit_length() - 2 * sys.float_info.mant_dig - 3) // 2
+    if q >= 0:
+        return (isqrt_round_to_odd(n, m << 2 * q) << q) / 1
+    return isqrt_round_to_odd(n << -2 * q, m) / (1 << -q)
+
+def isqrt_round_to_odd(n, m):
+    root = math.isqrt(n // m)
+    return root | (root * root * m != n)
+
+def get_stats(var_key):
+    # running aggregates of a variable
+
+    var = core.Main.variables_[-1][var_key]
+    if not isinstance(var, (Variable, CaptureBuffer)):
+        var = own_var(var_key)
+    return var.aggregates()
+
+def own_var(var_key):
+    # a variable that can be changed in place in the current environment layer
+
+    variables = core.Main.variables_[-1]
+    var = variables[var_key]
+    if not isinstance(var, Variable) or var.owner is not variables:
+        stats = var.stats if isinstance(var, Variable) else None
+        var = Variable(var, variables)
+        if stats is not None:
+            var.stats = stats.copy()
+        variables[var_key] = var
+    return var
+
+################################################################################
+# capture buffers for &var.capture
+#
+#    - Captured rows are stored by column, which keeps large captures compact
+#      and lets a column be read as numbers without going through each row.
+#    - A buffer still reads like a list of rows (len, iteration, indexing,
+#      and repr), so it can be shown, referenced, and duplicated like any
+#      other variable.
+#    - Appending (-A) to or popping from a buffer turns it into a Variable.
+################################################################################
+
+class CaptureBuffer():
+    __slots__ = ('columns', 'lengths', 'owner', 'stats', 'typed')
+
+    def __init__(self, rows = (), owner = None):
+        self.columns = []
+        self.lengths = array('I')
+        self.owner = owner
+        self.stats = None
+        self.typed = {}
+        for row in rows:
+            self.append(row)
+
+    def append(self, row):
+        columns = self.columns
+        while len(columns) < len(row):
+            columns.append([None] * len(self.lengths))
+        for column, element in zip(columns, row):
+            column.append(element)
+        for column in columns[len(row):]:
+            column.append(None)
+        self.lengths.append(len(row))
+        if self.typed:
+            self.typed.clear()
+        if self.stats is not None:
+            self.stats.add(row)
+
+    @classmethod
+    def from_columns(cls, columns, lengths, owner = None):
+        buffer = cls(owner = owner)
+        buffer.columns = columns
+        buffer.lengths = array('I', lengths)
+        return buffer
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __iter__(self):
+        if not self.columns:
+            for _ in self.lengths:
+                yield []
+            return
+        for length, values in zip(self.lengths, zip(*self.columns)):
+            yield list(values[:length])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        length = self.lengths[index]
+        return [column[index] for column in self.columns[:length]]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, CaptureBuffer)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    __str__ = __repr__
+
+    def copy(self):
+        return list(self)
+
+    def sort(self, key = None, reverse = False):
+        rows = list(self)
+        order = sorted(range(len(rows)), key = lambda i: rows[i] if key is None else key(rows[i]), reverse = reverse)
+        self.columns = [[column[i] for i in order] for column in self.columns]
+        self.lengths = array('I', [self.lengths[i] for i in order])
+        self.typed.clear()
+
+    def reverse(self):
+        for column in self.columns:
+            column.reverse()
+        self.lengths.reverse()
+        self.typed.clear()
+
+    def aggregates(self):
+        if self.stats is None:
+            self.stats = Aggregates(self)
+        return self.stats
+
+    def numeric_column(self, index):
+        # a column as an array of floats, or None if not every row has a number there
+        if index not in self.typed:
+            try:
+                self.typed[index] = array('d', (float(element) for element in self.columns[index]))
+            except (IndexError, TypeError, ValueError):
+                self.typed[index] = None
+        return self.typed[index]
+
+def capture_row(var_key, elements):
+    # add a row of elements captured by &var.capture
+
+    variables = core.Main.variables_[-1]
+    var = variables.get(var_key)
+    if var is None and len(split_string(var_key)) == 1:
+        variables[var_key] = CaptureBuffer([elements], variables)
+    elif isinstance(var, CaptureBuffer):
+        if var.owner is not variables:
+            var = CaptureBuffer(var, variables)
+            variables[var_key] = var
+        var.append(elements)
+    else:
+        push_or_set_var(var_key, [elements])
+
 ################################################################################
 # var action handling
 ################################################################################
@@ -350,10 +822,35 @@ def var_capture(args, options):
 ########################################
 
 def var_combine(args, options):
-    # stub for action to combine captured sets of data
+    # combine captured rows from several variables into a new variable
 
-    core.Main.parser.no_options_recognized(options)
-    core.Main.msg.info_message(f"&var.combine {options} {args}")
+    join = False
+    for option in options:
+        if option in ['-j', '--join']:
+            join = True
+        else:
+            core.Main.parser.unrecognized_option(option)
+    keys = split_string(args) if args else []
+    if join and len(keys) != 4:
+        core.Main.msg.error_message('Usage: &var.combine --join <new-variable> <variable-1> <variable-2> <column>')
+        return
+    if not join and len(keys) < 3:
+        core.Main.msg.error_message('Usage: &var.combine <new-variable> <variable-1> <variable-2>[ <variable-3> ...]')
+        return
+    if join:
+        column = keys.pop().lstrip('$')
+        if not column.isdigit():
+            core.Main.msg.error_message(f"Invalid column: {column}")
+            return
+    captures = [captured_rows(key) for key in keys[1:]]
+    if None in captures:
+        return
+    if join:
+        rows = var_columns.join_rows(list(captures[0]), list(captures[1]), int(column))
+    else:
+        rows = [row for capture in captures for row in capture]
+    variables = core.Main.variables_[-1]
+    variables[keys[0]] = CaptureBuffer(rows, variables)
 
 ########################################
 
@@ -368,10 +865,41 @@ def var_release(args, options):
 ########################################
 
 def var_transform(args, options):
-    # stub for action to transform captured data
+    # compute columns, filter, and sort captured data (see var_columns)
 
     core.Main.parser.no_options_recognized(options)
-    core.Main.msg.info_message(f"&var.transform {options} {args}")
+    if args is None or len(args.split(None, 1)) < 2:
+        core.Main.msg.error_message('Usage: &var.transform <variable> <step>[; <step> ...]')
+        return
+    var_key, steps = args.split(None, 1)
+    capture = captured_rows(var_key)
+    if capture is None:
+        return
+    try:
+        columns, lengths = var_columns.transform(capture.columns, capture.lengths, steps)
+    except ZeroDivisionError:
+        core.Main.msg.error_message('Invalid transform: division by zero')
+    except (ArithmeticError, TypeError, ValueError) as e:
+        core.Main.msg.error_message(f"Invalid transform: {e}")
+    else:
+        variables = core.Main.variables_[-1]
+        variables[var_key] = CaptureBuffer.from_columns(columns, lengths, variables)
+
+########################################
+
+def captured_rows(var_key):
+    # a variable's rows as a capture buffer, or None (with an error) if it doesn't hold rows
+
+    if not check_var(var_key):
+        core.Main.msg.error_message(f"Variable not found: {var_key}")
+        return None
+    var = core.Main.variables_[-1][var_key]
+    if isinstance(var, CaptureBuffer):
+        return var
+    if not all(isinstance(row, list) for row in var):
+        core.Main.msg.error_message(f"Variable does not hold captured rows: {var_key}")
+        return None
+    return CaptureBuffer(var)
 
 ########################################
 
@@ -380,7 +908,13 @@ def process_release():
 
     if check_var(core.Main.release_key_):
         captures = get_var(core.Main.release_key_)
-        for capture in captures:
-            released_line = '  '.join([element if element != ' ' else '-' for element in capture])
-            bridge.Plugin.parse_line(released_line)
+        parse_elements = bridge.Plugin.parse_elements
+        if isinstance(captures, CaptureBuffer) and parse_elements is not None:
+            # captured rows are already split, so skip the join and re-split
+            for capture in captures:
+                parse_elements(capture)
+        else:
+            for capture in captures:
+                released_line = '  '.join([element if element != ' ' else '-' for element in capture])
+                bridge.Plugin.parse_line(released_line)
     core.Main.release_key_ = None